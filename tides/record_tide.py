@@ -20,17 +20,26 @@ import datetime
 import argparse
 import json
 from mongoengine import *
+from pymongo import UpdateOne
 from collections import OrderedDict
-from tides import tide_data_generator_from_web, TIDE_INFO_WEBPAGE_TEMPLATE, STATIONS
+from tides import tide_series_from_web, rows_from_series, TIDE_INFO_WEBPAGE_TEMPLATE, STATIONS
+from tides_series import TideSeries
+from tides_store import TideStore
+from tides_rollup import RollupStore
 
 
-MONGO_DB_TIDES_PREFIX = "tides"
+MONGO_DB_TIDES = "tides"
+MONGO_BATCH_SIZE = 1000  # Upserts sent to the server at once
 
 
 class Measurement(Document):
+    station = StringField(required=True)
     timestamp = DateTimeField(required=True)
-    level = DecimalField(required=True)
-    
+    level = FloatField(required=True)
+
+    # Recording the same window again updates rather than duplicates
+    meta = {'indexes': [{'fields': ['station', 'timestamp'], 'unique': True}]}
+
 
 def default(obj):
     """ Convert to isoformat - TBC"""
@@ -54,26 +63,44 @@ def get_time_series(station):
 
     tide_info_page = TIDE_INFO_WEBPAGE_TEMPLATE.format(station=STATIONS[station][0])
 
-    date2level = OrderedDict()
+    return tide_series_from_web(tide_info_page, station)
 
-    for date_time, level in tide_data_generator_from_web(tide_info_page):
-        date2level[str(date_time)] = level, station
 
-    return date2level
+def connect_mongodb(host='localhost', port=27017, **kwargs):
+    """ One connection (and its pool) for all the stations """
+
+    return connect(MONGO_DB_TIDES, host=host, port=port, **kwargs)
+
 
+def save_to_mongodb(series, batch_size=MONGO_BATCH_SIZE):
+    """ Upsert the readings of the series by (station, timestamp) - returns how many were new """
 
-def save_to_mongodb(station, date2level):
+    # Also creates the unique index the first time
+    collection = Measurement._get_collection()
 
-    connect(MONGO_DB_TIDES_PREFIX + '_' + station, host='localhost', port=27017)
+    # Naive UTC datetimes, as stored by MongoDB
+    timestamps = series.times.astype('datetime64[s]').tolist()
+    levels = series.levels.astype(float).round(3).tolist()
 
-    for timestamp, level in date2level.items():
+    upserts = [UpdateOne({'station': series.station, 'timestamp': timestamp}, {'$set': {'level': level}}, upsert=True)
+               for timestamp, level in zip(timestamps, levels)]
 
-        measurement = Measurement(timestamp=timestamp, level=level[0])
-        print(timestamp, level[0])
-        measurement.save()
+    new = 0
+    for start in range(0, len(upserts), batch_size):
+        result = collection.bulk_write(upserts[start:start + batch_size], ordered=False)
+        new += result.upserted_count
 
+    print(f'{new} new readings saved into MongoDB "{MONGO_DB_TIDES}"')
 
-def save_to_file(station, date2level):
+    return new
+
+
+def save_to_file(station, series):
+
+    date2level = OrderedDict()
+
+    for date_time, level in rows_from_series(series):
+        date2level[str(date_time)] = level, station
 
     last_date = next(reversed(date2level.keys()))
     last_date = str(last_date).replace(':', '-').replace(' ', '_')
@@ -87,12 +114,43 @@ def save_to_file(station, date2level):
     print(f'Data saved into "{dump_filename}"')
 
 
-def process(station):
+def load_file(filename):
+    """ Series of a file written by save_to_file """
+
+    with open(filename) as handle:
+        date2level = json.load(handle)
 
-    date2level = get_time_series(station)
+    times = [datetime.datetime.fromisoformat(date).timestamp() for date in date2level]
+    levels = [level for level, _ in date2level.values()]
+    station = next(iter(date2level.values()))[1] if date2level else ''
 
-    save_to_file(station, date2level)
-    #save_to_mongodb(station, date2level)
+    return TideSeries(times, levels, station)
+
+
+def save_to_store(series):
+    """ Append the readings not stored yet, and bring the rollups up to date """
+
+    store = TideStore()
+    count = store.append(series)
+
+    print(f'{count} new readings saved into "{store.path(series.station)}"')
+
+    if count:
+        # Only the last buckets are recomputed
+        RollupStore(store).update(series.station)
+
+
+def process(station, save_to_json=False, save_to_mongo=False):
+
+    series = get_time_series(station)
+
+    save_to_store(series)
+
+    if save_to_json:
+        save_to_file(station, series)
+
+    if save_to_mongo:
+        save_to_mongodb(series)
 
 
 def main():
@@ -101,7 +159,9 @@ def main():
     parser = argparse.ArgumentParser(description='Find time between high tides at two stations.\nDefault stations are Chelsea and Dover.')
     parser.add_argument('--list', help='list all stations', action='store_true')
     parser.add_argument('--station', help='station')
-    parser.add_argument('--save', help='save to file', action='store_true')
+    parser.add_argument('--save', help='also save the whole window to a .dat (JSON) file', action='store_true')
+    parser.add_argument('--load', help='load .dat files into the store', nargs='+', metavar='FILE')
+    parser.add_argument('--mongodb', help='also save to the MongoDB server on this host', metavar='HOST')
     args = parser.parse_args()
 
     if args.list:
@@ -109,14 +169,23 @@ def main():
             print(station)
         sys.exit(0)
 
+    if args.load:
+        # Oldest first, the store only takes readings newer than what it has
+        for filename in sorted(args.load):
+            save_to_store(load_file(filename))
+        sys.exit(0)
+
     station = args.station
 
     if station is None:
         station = 'Chelsea'
 
     
-    process('Chelsea')
-    process('Westminster')
+    if args.mongodb:
+        connect_mongodb(args.mongodb)
+
+    process('Chelsea', args.save, bool(args.mongodb))
+    process('Westminster', args.save, bool(args.mongodb))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are scripts next to this directory, not an installed package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,69 @@
+"""
+Cross correlation of two stations - the FFT against a scan of the lags, the refined lag of shifted tides
+"""
+
+import numpy as np
+from tides_series import TideSeries
+from tides_correlations import cross_correlation, correlate
+
+PERIOD = 12.42 * 3600  # s - semi-diurnal tide
+
+
+def tides(shift_minutes=0, days=5, noise=0.0, seed=1, station='Chelsea'):
+    """ Readings every 15 minutes, the tide shift_minutes later than with no shift """
+
+    times = 1_600_000_000 + 900 * np.arange(days * 24 * 4)
+    phase = 2 * np.pi * (times - shift_minutes * 60) / PERIOD
+    # With an overtide, as the Thames - the rise is faster than the fall
+    levels = 2.5 * np.sin(phase) + 0.4 * np.sin(2 * phase + 1) + np.random.default_rng(seed).normal(0, noise, len(times))
+
+    return TideSeries(times, levels, station)
+
+
+def test_cross_correlation_matches_pearson_scan():
+
+    rng = np.random.default_rng(1)
+    a = np.cumsum(rng.normal(size=200))
+    b = np.roll(a, 7) + rng.normal(size=200)
+
+    lags, correlations = cross_correlation(a, b, 50)
+
+    for lag, correlation in zip(lags, correlations):
+        n = len(a)
+        expected = np.corrcoef(a[max(lag, 0):n + min(lag, 0)], b[max(-lag, 0):n - max(lag, 0)])[0, 1]
+        assert np.isclose(correlation, expected)
+
+
+def test_refined_lag_recovers_the_shift():
+
+    for shift in [7, 22, -37]:
+        lag_correlation = correlate(tides(), tides(shift, noise=0.02, station='Westminster'))
+
+        # The second station, shift minutes later, lines up shifted back by as much - between grid points
+        assert abs(lag_correlation.lag_minutes + shift) < 0.5
+        low, high = lag_correlation.confidence_interval
+        assert low < -shift < high
+        assert lag_correlation.peak_correlation > 99
+
+
+def test_flat_series():
+
+    series = tides()
+    flat = TideSeries(series.times, np.full(len(series), 1.5), 'Westminster')
+
+    lag_correlation = correlate(series, flat)
+
+    assert lag_correlation.best_lag_minutes is None
+    assert lag_correlation.lag_minutes is None
+    assert np.isnan(lag_correlation.correlations).all()
+
+
+def test_no_overlap():
+
+    series = tides()
+    later = TideSeries(series.times + 10 * 24 * 3600, series.levels, 'Westminster')
+
+    lag_correlation = correlate(series, later)
+
+    assert lag_correlation.best_lag_minutes is None
+    assert lag_correlation.lag_minutes is None
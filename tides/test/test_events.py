@@ -0,0 +1,56 @@
+"""
+High and low water of noisy readings - one turn per half tide, the same streamed or in one go
+"""
+
+import numpy as np
+from tides_series import TideSeries
+from tides_events import EventDetector, detect_events, HIGH, LOW, MIN_SEPARATION
+
+PERIOD = 12.42 * 3600  # s - semi-diurnal tide
+
+
+def noisy_tides(days, noise, seed=1):
+
+    count = days * 24 * 4
+    times = 1_600_000_000 + 900 * np.arange(count)
+    levels = 2.5 * np.sin(2 * np.pi * (times - times[0]) / PERIOD) + np.random.default_rng(seed).normal(0, noise, count)
+
+    return TideSeries(times, levels, 'Chelsea')
+
+
+def test_one_turn_per_half_tide():
+
+    # Gauge noise, then as much as the confirmation level
+    for noise, error in [(0.03, 3600), (0.05, 2 * 3600)]:
+        for seed in range(10):
+            series = noisy_tides(10, noise, seed)
+            events = detect_events(series)
+
+            # Highs at a quarter period, lows at three quarters, the last may not be confirmed yet
+            turns = int((series.times[-1] - series.times[0] - PERIOD / 4) / (PERIOD / 2)) + 1
+            assert turns - 1 <= len(events) <= turns
+
+            kinds = [event.kind for event in events]
+            assert kinds == [[HIGH, LOW][k % 2] for k in range(len(kinds))]
+
+            times = np.array([event.time for event in events])
+            assert np.all(np.diff(times) >= MIN_SEPARATION)
+
+            expected = series.times[0] + PERIOD / 4 + PERIOD / 2 * np.arange(len(events))
+            assert np.all(np.abs(times - expected) < error)
+
+
+def test_streaming_matches_batch():
+
+    for noise in [0.01, 0.05, 0.1]:
+        for seed in range(10):
+            series = noisy_tides(10, noise, seed)
+
+            # Pushed page by page, as tides.py --watch polls, some readings repeated
+            detector = EventDetector('Chelsea')
+            streamed = []
+            for end in range(96, len(series) + 96, 96):
+                streamed += detector.extend(series[max(end - 192, 0):end])
+
+            assert ([event.__dict__ for event in streamed]
+                    == [event.__dict__ for event in detect_events(series)])
@@ -0,0 +1,35 @@
+"""
+The station pages downloaded at once from the stub server - as long as the slowest, not the sum
+"""
+
+import time
+from tides import parse_columns
+from tides_fetch import fetch_page, fetch_pages
+from tides_stub import start_stub_server
+
+
+# Nine stations answering in 100ms to 500ms
+DELAYS = [100 + 50 * i for i in range(9)]
+
+
+def test_concurrent_fetch_takes_the_slowest():
+
+    server = start_stub_server()
+
+    try:
+        urls = {i: f'http://127.0.0.1:{server.server_port}/plain/{delay}' for i, delay in enumerate(DELAYS)}
+
+        # Session and imports, not to be timed
+        fetch_page(f'http://127.0.0.1:{server.server_port}/plain/0')
+
+        start = time.perf_counter()
+        pages = dict(fetch_pages(urls))
+        concurrent_time = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    assert sorted(pages) == list(urls)
+    assert all(len(parse_columns(page)[0]) for page in pages.values())
+
+    assert concurrent_time < max(DELAYS) / 1000 * 1.5
+    assert concurrent_time < sum(DELAYS) / 1000 / 2
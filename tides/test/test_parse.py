@@ -0,0 +1,43 @@
+"""
+The compiled row pattern and the BeautifulSoup fallback read the same readings from the fixture, the fallback counted
+"""
+
+import os
+import numpy as np
+from tides import parse_columns, parse_soup, decode_timestamps
+from tides_metrics import METRICS
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Thames_Tide.html')
+
+
+def test_parse_columns_matches_parse_soup():
+
+    with open(FIXTURE) as f:
+        page = f.read()
+
+    timestrings, water_levels = parse_soup(page)
+    times, levels = parse_columns(page)
+
+    assert len(times) > 0
+    # The page has the latest reading first
+    assert np.array_equal(times, decode_timestamps(timestrings)[::-1])
+    assert np.array_equal(levels, np.array([float(level) for level in water_levels])[::-1])
+
+
+def test_changed_layout_falls_back_to_parse_soup(capsys):
+
+    with open(FIXTURE) as f:
+        page = f.read()
+
+    # Rows the pattern doesn't match any more
+    changed = page.replace('<td class="numeric">', '<td class="numeric value">', 3)
+    errors = METRICS.stages['parse'].errors
+
+    times, levels = parse_columns(changed)
+    assert METRICS.stages['parse'].errors == errors + 1
+    assert 'BeautifulSoup' in capsys.readouterr().out
+
+    expected_times, expected_levels = parse_columns(page)
+    assert np.array_equal(times, expected_times)
+    assert np.array_equal(levels, expected_levels)
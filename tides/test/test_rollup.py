@@ -0,0 +1,46 @@
+"""
+Rollups and tide table kept up to date as readings are appended are the same as rebuilt from all of them
+"""
+
+import numpy as np
+from tides_series import TideSeries
+from tides_store import TideStore
+from tides_rollup import RollupStore, PERIODS
+
+
+def noisy_tides(days, seed=1):
+
+    count = days * 24 * 4
+    times = 1_600_000_000 + 900 * np.arange(count)
+    hours = np.arange(count) / 4
+    levels = 2.5 * np.sin(2 * np.pi * hours / 12.42) + np.random.default_rng(seed).normal(0, 0.1, count)
+
+    return TideSeries(times, levels, 'Chelsea')
+
+
+def test_incremental_updates_match_rebuild(tmp_path):
+
+    series = noisy_tides(40)
+    store = TideStore(str(tmp_path))
+    rollups = RollupStore(store)
+
+    # Overlapping 5 day pages, as record_tide.py gets them, some polls bringing nothing new
+    rng = np.random.default_rng(2)
+    end = 0
+    while end < len(series):
+        end += int(rng.integers(0, 200))
+        store.append(series[max(end - 480, 0):end])
+        rollups.update('Chelsea')
+
+    incremental = {period: np.array(rollups.records('Chelsea', period)) for period in PERIODS}
+    table = [event.to_dict() for event in rollups.tide_table('Chelsea')]
+
+    rollups.rebuild('Chelsea')
+
+    for period in PERIODS:
+        rebuilt = np.array(rollups.records('Chelsea', period))
+        assert len(incremental[period]) == len(rebuilt)
+        for field in rebuilt.dtype.names:
+            assert np.array_equal(incremental[period][field], rebuilt[field], equal_nan=True)
+
+    assert table == [event.to_dict() for event in rollups.tide_table('Chelsea')]
@@ -0,0 +1,89 @@
+"""
+The readings stored once each, in time order, whatever the pages appended - and the ranges queried
+"""
+
+import numpy as np
+from tides_series import TideSeries
+from tides_store import TideStore, RECORD
+
+START = 1_600_000_000
+DAY = 24 * 3600
+
+
+def readings(first, count):
+    """ Every 15 minutes from the first, the level telling them apart """
+
+    times = START + 900 * np.arange(first, first + count)
+
+    return TideSeries(times, (times - START) / 900 / 1000, 'Chelsea')
+
+
+def test_empty_store(tmp_path):
+
+    store = TideStore(str(tmp_path))
+
+    assert store.last_time('Chelsea') is None
+    assert len(store.query('Chelsea')) == 0
+    assert len(store.query('Chelsea', START, START + DAY)) == 0
+
+
+def test_query_ranges(tmp_path):
+
+    store = TideStore(str(tmp_path))
+    store.append(readings(0, 96))
+
+    # Before, after, and around the readings
+    assert len(store.query('Chelsea', START - DAY, START)) == 0
+    assert len(store.query('Chelsea', START + DAY, START + 2 * DAY)) == 0
+    assert len(store.query('Chelsea', START - DAY, START + 2 * DAY)) == 96
+    assert len(store.query('Chelsea', end=START)) == 0
+    assert len(store.query('Chelsea', START + DAY)) == 0
+
+    # From start included to end excluded
+    series = store.query('Chelsea', START + 900, START + 3 * 900)
+    assert series.times.tolist() == [START + 900, START + 2 * 900]
+    assert series.station == 'Chelsea'
+
+
+def test_overlapping_appends(tmp_path):
+
+    store = TideStore(str(tmp_path))
+
+    # Five days pages polled every day, as record_tide.py gets them
+    counts = [store.append(readings(96 * day, 5 * 96)) for day in range(4)]
+    assert counts == [5 * 96, 96, 96, 96]
+
+    # Nothing newer
+    assert store.append(readings(0, 8 * 96)) == 0
+
+    series = store.query('Chelsea')
+    assert np.array_equal(series.times, readings(0, 8 * 96).times)
+    assert np.allclose(series.levels, readings(0, 8 * 96).levels)
+    assert store.last_time('Chelsea') == int(series.times[-1])
+
+
+def test_repeated_readings_stored_once(tmp_path):
+
+    store = TideStore(str(tmp_path))
+
+    # The station pages repeat some readings, newest first
+    page = readings(0, 10)
+    times = np.concatenate((page.times, page.times[5:]))[::-1]
+    levels = np.concatenate((page.levels, page.levels[5:]))[::-1]
+
+    assert store.append(TideSeries(times, levels, 'Chelsea')) == 10
+    assert np.array_equal(store.query('Chelsea').times, page.times)
+
+
+def test_partly_written_record_left_out(tmp_path):
+
+    store = TideStore(str(tmp_path))
+    store.append(readings(0, 10))
+
+    # A crash while appending
+    with open(store.path('Chelsea'), 'ab') as f:
+        f.write(b'\0' * (RECORD.itemsize // 2))
+
+    assert len(store.query('Chelsea')) == 10
+    assert store.append(readings(0, 12)) == 2
+    assert np.array_equal(store.query('Chelsea').times, readings(0, 12).times)
@@ -0,0 +1,43 @@
+"""
+Running statistics of the sliding window - the same as the TideSeries of the readings in it
+"""
+
+import numpy as np
+from tides_series import TideSeries
+from tides_window import TideWindow
+
+DAY = 24 * 3600
+STATISTICS = ['max_level', 'min_level', 'mean_level', 'amplitude', 'max_rise_speed', 'max_fall_speed']
+
+
+def noisy_tides(days, seed=1):
+
+    count = days * 24 * 4
+    times = 1_600_000_000 + 900 * np.arange(count)
+    hours = np.arange(count) / 4
+    levels = 2.5 * np.sin(2 * np.pi * hours / 12.42) + np.random.default_rng(seed).normal(0, 0.1, count)
+
+    return TideSeries(times, levels, 'Chelsea')
+
+
+def test_running_statistics_match_series():
+
+    series = noisy_tides(10)
+    window = TideWindow('Chelsea', DAY)
+
+    # Overlapping pages of up to 2 days, some polls bringing nothing new
+    rng = np.random.default_rng(2)
+    end = 0
+    while end < len(series):
+        end += int(rng.integers(0, 40))
+        window.extend(series[max(end - 192, 0):end])
+        if len(window) == 0:
+            continue
+
+        # The day up to the latest reading, from this page and the earlier ones
+        latest = window.last_time
+        expected = series[np.searchsorted(series.times, latest - DAY):np.searchsorted(series.times, latest) + 1]
+
+        assert np.array_equal(window.times, expected.times)
+        for statistic in STATISTICS if len(expected) > 1 else STATISTICS[:4]:
+            assert np.isclose(getattr(window, statistic), getattr(expected, statistic), rtol=1e-6), statistic
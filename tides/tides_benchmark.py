@@ -0,0 +1,1003 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmarks for the tides scripts, run against the saved station page.
+
+The pipeline benchmark times each stage from the station page to the stored readings, also
+on synthetic pages of the 9 stations, against the baseline in benchmarks/pipeline.json:
+
+    tides_benchmark.py pipeline [--datasets fixture 5d 1m 1y] [--save]
+"""
+
+import io
+import os
+import sys
+import json
+import base64
+import platform
+import subprocess
+import time
+import timeit
+import argparse
+import datetime
+import contextlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import pytz
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from tides import parse, parse_columns, parse_soup, decode_timestamps, london_datetime64, STATIONS, ROW_PATTERN
+from tides import tide_series_from_web, tide_series_from_file, tide_series_from_page, process, report
+from tides_render import TideRenderer, downsample_indices, FIGSIZE, WATER_COLOR, TIDE_RISE_COLOR, TITLE_FONT, BOX_BACKGROUND_COLOR
+from tides_series import TideSeries
+from tides_window import TideWindow
+from tides_events import EventDetector, detect_events
+from tides_prediction import fit, hours_since_reference, CONSTITUENTS
+from tides_store import TideStore
+from tides_rollup import RollupStore, history
+from record_tide import save_to_file, load_file, connect_mongodb, save_to_mongodb, Measurement
+from tides_correlations import correlate, series_to_dataframe
+from tides_fetch import fetch_page, fetch_pages, PAGE_CACHE
+from tides_metrics import Metrics
+from tides_pool import RenderPool, WORKERS
+from tides_stub import start_stub_server, FIXTURE
+
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tides_app_lambda')
+
+# Not to be imported until they are used
+HEAVY_MODULES = ('matplotlib', 'bs4', 'lxml', 'requests', 'pandas', 'pytz')
+
+
+def best_of(function, number, repeat=5):
+    """ Best time in seconds of one call of function """
+
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def bench_parse(number):
+
+    with open(FIXTURE) as f:
+        page = f.read()
+
+    # The fallback is there for correctness: both parsers have to agree
+    timestrings, water_levels = parse_soup(page)
+    times, levels = parse_columns(page)
+    assert np.array_equal(times, decode_timestamps(timestrings)[::-1])
+    assert np.array_equal(levels, np.array([float(level) for level in water_levels])[::-1])
+
+    soup_time = best_of(lambda: parse_soup(page), number)
+    fast_time = best_of(lambda: parse_columns(page), number)
+    rows_time = best_of(lambda: list(parse(page)), number)
+
+    print(f'parse_soup    {soup_time * 1000:8.2f}ms')
+    print(f'parse_columns {fast_time * 1000:8.2f}ms   ({soup_time / fast_time:.1f}x faster)')
+    print(f'parse (rows)  {rows_time * 1000:8.2f}ms')
+
+
+def london_time_per_row(timestring):
+    """ The original per row conversion, as a reference """
+
+    naive_time = datetime.datetime.strptime(timestring, "%Y-%m-%dT%H:%MZ")
+    tz_time = pytz.timezone('UTC').localize(naive_time)
+
+    return tz_time.astimezone(pytz.timezone('Europe/London'))
+
+
+def bench_timestamps(number):
+
+    with open(FIXTURE) as f:
+        timestrings = parse_soup(f.read())[0]
+
+    # A month worth of readings
+    timestrings = timestrings * 7
+
+    per_row_time = best_of(lambda: [london_time_per_row(t) for t in timestrings], number)
+    batch_time = best_of(lambda: london_datetime64(decode_timestamps(timestrings)), number)
+
+    print(f'{len(timestrings)} timestamps')
+    print(f'per row london_time    {per_row_time * 1000:8.2f}ms')
+    print(f'batch decode + offsets {batch_time * 1000:8.2f}ms   ({per_row_time / batch_time:.1f}x faster)')
+
+
+def bench_fetch(number):
+
+    server = start_stub_server()
+
+    # Nine stations answering in 100ms to 500ms
+    delays = [100 + 50 * i for i in range(9)]
+    urls = {i: f'http://127.0.0.1:{server.server_port}/station/{delay}' for i, delay in enumerate(delays)}
+
+    def serial():
+        for url in urls.values():
+            parse_columns(fetch_page(url))
+
+    def concurrent():
+        for _, page in fetch_pages(urls):
+            parse_columns(page)
+
+    serial_time = min(timeit.repeat(serial, number=1, repeat=3))
+    concurrent_time = min(timeit.repeat(concurrent, number=1, repeat=3))
+
+    server.shutdown()
+
+    print(f'{len(urls)} stations, slowest {max(delays)}ms, sum {sum(delays)}ms')
+    print(f'serial     {serial_time * 1000:8.0f}ms')
+    print(f'concurrent {concurrent_time * 1000:8.0f}ms   ({serial_time / concurrent_time:.1f}x faster)')
+
+    # As long as the slowest download, not the sum of them (also checked by test/test_fetch.py)
+    assert concurrent_time < max(delays) / 1000 * 1.5, 'The pages were not downloaded concurrently'
+    assert concurrent_time < sum(delays) / 1000 / 2, 'The pages were not downloaded concurrently'
+
+
+def bench_conditional(number):
+
+    server = start_stub_server()
+
+    for kind in ('station', 'plain'):
+        url = f'http://127.0.0.1:{server.server_port}/{kind}/0'
+
+        def first():
+            PAGE_CACHE.clear()
+            tide_series_from_web(url)
+
+        first_time = best_of(first, number)
+        again_time = best_of(lambda: tide_series_from_web(url), number)
+
+        reason = '304 Not Modified' if kind == 'station' else 'same body'
+        print(f'{kind:8} first download {first_time * 1000:6.2f}ms   unchanged ({reason}) {again_time * 1000:6.2f}ms')
+
+    server.shutdown()
+
+
+def bench_store(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        os.chdir(directory)
+
+        # A year of readings already stored
+        year = 365 * 24 * 4
+        times = series.times[0] - 900 * np.arange(year, 0, -1)
+        levels = np.resize(series.levels, year)
+        store = TideStore()
+        store.append(TideSeries(times, levels, 'Chelsea'))
+        store.append(series)
+
+        json_time = best_of(lambda: save_to_file('Chelsea', series), number)
+
+        # The next run brings a single new reading
+        runs = 1
+
+        def append():
+            nonlocal runs
+            newer = TideSeries(series.times + 900 * runs, series.levels, 'Chelsea')
+            runs += 1
+            store.append(newer)
+        append_time = best_of(append, number)
+
+        day = 24 * 3600
+        middle = int(times[year // 2])
+        query_time = best_of(lambda: store.query('Chelsea', middle, middle + day), number)
+
+        os.chdir(cwd)
+
+    print(f'save_to_file (5 days JSON)  {json_time * 1000:8.2f}ms')
+    print(f'store append (new readings) {append_time * 1000:8.2f}ms')
+    print(f'store query (1 day of 1 year) {query_time * 1000:6.2f}ms')
+
+
+def bench_mongodb(number):
+
+    from mongoengine import disconnect
+    from pymongo.errors import ServerSelectionTimeoutError
+
+    # Against a local mongod - mongomock (if installed) only checks the code runs,
+    # it scans the collection for every upsert so the numbers mean nothing
+    try:
+        connect_mongodb(serverSelectionTimeoutMS=2000)
+        Measurement._get_db().command('ping')
+        server = 'mongod on localhost'
+        count = 30 * 24 * 4
+    except ServerSelectionTimeoutError:
+        import mongomock
+        disconnect()
+        connect_mongodb(mongo_client_class=mongomock.MongoClient)
+        server = 'mongomock - NOT representative, no mongod on localhost'
+        count = 24 * 4
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+    readings = TideSeries(series.times[0] + 900 * np.arange(count), np.resize(series.levels, count), 'Chelsea')
+
+    def per_document():
+        Measurement.drop_collection()
+        for timestamp, level in zip(readings.times.astype('datetime64[s]').tolist(), readings.levels.tolist()):
+            Measurement(station=readings.station, timestamp=timestamp, level=level).save()
+
+    def bulk():
+        Measurement.drop_collection()
+        save_to_mongodb(readings)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        per_document_time = min(timeit.repeat(per_document, number=1, repeat=3))
+        bulk_time = min(timeit.repeat(bulk, number=1, repeat=3))
+        # Recording the same window again
+        again_time = min(timeit.repeat(lambda: save_to_mongodb(readings), number=1, repeat=3))
+
+    stored = Measurement.objects.count()
+    Measurement.drop_collection()
+
+    print(f'{count} readings, {server}')
+    print(f'per document save {count / per_document_time:10.0f} rows/s')
+    print(f'bulk upsert       {count / bulk_time:10.0f} rows/s   ({per_document_time / bulk_time:.1f}x faster)')
+    print(f'bulk upsert again {count / again_time:10.0f} rows/s   ({stored} stored)')
+
+
+def correlation_with_shift_per_row(df1, df2, delta_mins):
+    """ The original lag search step, as a reference: shift row by row, merge and correlate """
+
+    df2_shifted = df2.copy()
+
+    for ix in df2_shifted.index:
+        df2_shifted.loc[ix, 'Date'] += pd.Timedelta(minutes=delta_mins)
+
+    df2_shifted.columns = [df2_shifted.columns[0], df2_shifted.columns[1] + ' (shifted)']
+    df_all = pd.merge(df1, df2_shifted, how='inner', on='Date').merge(df2, how='inner', on='Date')
+
+    return df_all.corr()[df_all.columns[1]][df_all.columns[2]] * 100
+
+
+def bench_correlation(number):
+
+    series1 = tide_series_from_file(FIXTURE, 'Chelsea')
+    series2 = TideSeries(series1.times + 45 * 60, series1.levels, 'Westminster')
+    dfs = [series_to_dataframe(series) for series in (series1, series2)]
+
+    per_row_time = min(timeit.repeat(lambda: [correlation_with_shift_per_row(dfs[0], dfs[1], delta_mins)
+                                              for delta_mins in range(-6 * 60, 6 * 60, 15)], number=1, repeat=1))
+    fft_time = best_of(lambda: correlate(series1, series2, 6 * 60), number)
+
+    # A month at both stations, shifts up to a day
+    month = 30 * 24 * 4
+    long1 = TideSeries(series1.times[0] + 900 * np.arange(month), np.resize(series1.levels, month), 'Chelsea')
+    long2 = TideSeries(long1.times + 45 * 60, long1.levels, 'Westminster')
+    fft_month_time = best_of(lambda: correlate(long1, long2, 24 * 60), number)
+
+    print(f'5 days, +/-6h   per shift merge loop {per_row_time * 1000:9.1f}ms')
+    print(f'5 days, +/-6h   FFT                  {fft_time * 1000:9.2f}ms   ({per_row_time / fft_time:.0f}x faster)')
+    print(f'1 month, +/-24h FFT                  {fft_month_time * 1000:9.2f}ms')
+
+
+def bench_window(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+
+    # A month of readings, polled one new reading at a time over a 5 day window
+    count = 30 * 24 * 4
+    window_count = 5 * 24 * 4
+    month = TideSeries(series.times[0] + 900 * np.arange(count), np.resize(series.levels, count), 'Chelsea')
+    polls = range(window_count + 1, count)
+
+    def rescan():
+        for k in polls:
+            latest = month[k - window_count:k]
+            (latest.max_level, latest.min_level, latest.mean_level, latest.max_rise_speed, latest.max_fall_speed)
+
+    def incremental():
+        window = TideWindow.from_series(month[:window_count])
+        for k in polls:
+            window.extend(month[k - window_count:k])
+            (window.max_level, window.min_level, window.mean_level, window.max_rise_speed, window.max_fall_speed)
+
+    rescan_time = best_of(rescan, 1, repeat=3) / len(polls)
+    incremental_time = best_of(incremental, 1, repeat=3) / len(polls)
+
+    print('5 day window, one new reading per poll')
+    print(f'full rescan  {rescan_time * 1e6:8.1f}us per poll')
+    print(f'incremental  {incremental_time * 1e6:8.1f}us per poll   ({rescan_time / incremental_time:.1f}x faster)')
+
+    # CPU of polling 9 stations with no new readings: download, parse and report all of them
+    # against conditional downloads and merging nothing
+    server = start_stub_server()
+    urls = {station: f'http://127.0.0.1:{server.server_port}/station/0?{station}' for station in range(9)}
+
+    def poll_everything():
+        for url in urls.values():
+            report(TideSeries(*parse_columns(fetch_page(url))), 'Chelsea', show_plot=False)
+
+    windows = {}
+
+    def poll_incremental():
+        for station, latest in fetch_pages(urls, parse=tide_series_from_page):
+            if station not in windows:
+                windows[station] = TideWindow.from_series(latest)
+            elif windows[station].extend(latest):
+                report(windows[station], 'Chelsea', show_plot=False)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        poll_incremental()
+        everything_cpu = min(cpu_time(poll_everything) for _ in range(3))
+        incremental_cpu = min(cpu_time(poll_incremental) for _ in range(3))
+
+    server.shutdown()
+
+    print('9 stations, nothing new')
+    print(f'download, parse and report all {everything_cpu * 1000:6.1f}ms CPU per poll')
+    print(f'conditional, merge new only    {incremental_cpu * 1000:6.1f}ms CPU per poll')
+
+
+def cpu_time(function):
+    """ CPU seconds of all the threads of the process during one call of function """
+
+    start = time.process_time()
+    function()
+
+    return time.process_time() - start
+
+
+def bench_events(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+
+    # A year at one station: the fixture tides repeated, with some noise
+    count = 365 * 24 * 4
+    rng = np.random.default_rng(0)
+    year = TideSeries(series.times[0] + 900 * np.arange(count),
+                      np.round(np.resize(series.levels, count) + rng.normal(0, 0.01, count), 2), 'Chelsea')
+
+    def streaming():
+        return EventDetector('Chelsea').extend(year)
+
+    streaming_time = best_of(streaming, 1, repeat=3)
+    backfill_time = best_of(lambda: detect_events(year), 1, repeat=3)
+    events = detect_events(year)
+
+    # One new reading at a time, as when watching
+    detector = EventDetector('Chelsea')
+    detector.extend(year[:-number * 10])
+    start = time.perf_counter()
+    for k in range(count - number * 10, count):
+        detector.push(int(year.times[k]), float(year.levels[k]))
+    push_time = (time.perf_counter() - start) / (number * 10)
+
+    print(f'1 year, {len(events)} high and low waters')
+    print(f'streaming, reading by reading {streaming_time * 1000:8.1f}ms')
+    print(f'vectorized backfill           {backfill_time * 1000:8.1f}ms   ({streaming_time / backfill_time:.1f}x faster)')
+    print(f'one new reading               {push_time * 1e6:8.2f}us')
+
+
+def bench_prediction(number):
+
+    # Readings every 15 minutes from the main constituents, with some noise
+    rng = np.random.default_rng(0)
+    constituents = {'M2': (2.5, 40), 'S2': (0.7, 100), 'N2': (0.45, 10), 'K1': (0.15, 200), 'O1': (0.12, 300),
+                    'M4': (0.3, 250), 'MS4': (0.1, 60)}
+
+    def history(days):
+        times = 1_700_000_000 + 900 * np.arange(days * 24 * 4)
+        hours = hours_since_reference(times)
+        levels = 0.8 + sum(amplitude * np.cos(np.radians(CONSTITUENTS[name]) * hours - np.radians(phase))
+                           for name, (amplitude, phase) in constituents.items())
+        return TideSeries(times, levels + rng.normal(0, 0.05, len(times)), 'Chelsea')
+
+    for days in (90, 365):
+        series = history(days)
+        fit_time = best_of(lambda: fit(series), 1, repeat=3)
+        model = fit(series)
+        print(f'fit {days:3} days ({len(series)} readings, {len(model.constituents)} constituents)'
+              f' {fit_time * 1000:7.1f}ms   rms {model.rms:.3f}m')
+
+    year = np.arange(series.times[-1], series.times[-1] + 365 * 24 * 3600, 900)
+    predict_time = best_of(lambda: model.predict(year), number)
+    print(f'predict 1 year ({len(year)} levels)         {predict_time * 1000:7.1f}ms')
+
+
+def render_png_per_call(dates, levels, speed, title, info):
+    """ The original plot, as a reference: a new pyplot figure per render, closed after """
+
+    figure = plt.figure(figsize=FIGSIZE)
+    plot = figure.add_subplot(111)
+    plot.plot(dates, levels, WATER_COLOR, marker='.', linewidth=3.0, label='Water level')
+    plt.ylabel('Water level (m)', color=WATER_COLOR, fontweight='bold', fontsize=22)
+
+    plot2 = plot.twinx()
+    plot2.plot(dates[:-1], speed, TIDE_RISE_COLOR, marker='.', linewidth=0.5, label='Tide rise speed')
+    plot.axhline(linewidth=1, color='r')
+    plot.grid(color='g', linestyle=':', linewidth=0.5)
+    plt.ylabel('Tide rise speed (cm/min)', color=TIDE_RISE_COLOR, fontweight='bold', fontsize=22)
+
+    plot.scatter(dates[-1], levels[-1], marker='o', s=400, c=WATER_COLOR)
+    plot2.scatter(dates[-2], speed[-1], marker='o', s=400, c=TIDE_RISE_COLOR)
+    plt.title(title, fontdict=TITLE_FONT)
+
+    for label in plot.get_xticklabels() + plot2.get_xticklabels():
+        label.set_rotation(30)
+        label.set_horizontalalignment('right')
+        label.set_fontsize(12)
+    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M'))
+
+    level_info_box = plt.text(dates[0], 0, info, fontsize=32)
+    level_info_box.set_bbox(dict(facecolor=BOX_BACKGROUND_COLOR, alpha=1, edgecolor=BOX_BACKGROUND_COLOR))
+    plot.legend(loc='upper left', fontsize='x-large')
+    plot2.legend(loc='upper right', fontsize='x-large')
+
+    image_bytes = io.BytesIO()
+    plt.savefig(image_bytes, format='png')
+    plt.close()
+
+    return image_bytes.getvalue()
+
+
+def bench_render(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')[4 * 24 * 4:]
+    args = (london_datetime64(series.times), series.levels, series.speed, 'Thames at Chelsea', 'Now=2.3m')
+
+    per_call_time = best_of(lambda: render_png_per_call(*args), number, repeat=3)
+
+    renderer = TideRenderer()
+    reused_time = best_of(lambda: renderer.render_png(*args), number, repeat=3)
+
+    # One renderer per station, rendering at the same time
+    threads = 4
+    renderers = [TideRenderer() for _ in range(threads)]
+
+    def render_all():
+        workers = [threading.Thread(target=lambda r=r: [r.render_png(*args) for _ in range(number)])
+                   for r in renderers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    threaded_time = best_of(render_all, 1, repeat=3) / (threads * number)
+
+    print(f'new pyplot figure per render {1 / per_call_time:6.1f} renders/s')
+    print(f'reused renderer              {1 / reused_time:6.1f} renders/s   ({per_call_time / reused_time:.1f}x faster)')
+    print(f'{threads} renderers, {threads} threads     {1 / threaded_time:6.1f} renders/s')
+    print(f'pyplot figures left open     {len(plt.get_fignums())}')
+
+
+def bench_metrics(number):
+
+    metrics = Metrics()
+
+    def timed():
+        with metrics.timed('parse'):
+            pass
+
+    def traced():
+        metrics.start_trace()
+        timed()
+        metrics.end_trace()
+
+    timed_time = best_of(timed, number * 10000)
+    traced_time = best_of(traced, number * 10000)
+    parse_time = best_of(lambda: tide_series_from_file(FIXTURE), number)
+
+    print(f'timed stage         {timed_time * 1e6:6.2f}us')
+    print(f'timed stage, traced {traced_time * 1e6:6.2f}us')
+    print(f'parse of the page   {parse_time * 1e6:6.0f}us   ({timed_time / parse_time:.2%} overhead)')
+    print(f'exposition          {best_of(metrics.exposition, number) * 1e6:6.0f}us')
+
+
+def bench_dashboard(number):
+
+    import tides
+    from tides_dashboard import dashboard_from_web, POOL_PROCESSES
+
+    server = start_stub_server()
+    template = tides.TIDE_INFO_WEBPAGE_TEMPLATE
+    tides.TIDE_INFO_WEBPAGE_TEMPLATE = f'http://127.0.0.1:{server.server_port}/station/0?station={{station}}'
+
+    def separately():
+        PAGE_CACHE.clear()
+        for station in tides.STATIONS:
+            tides.process_from_web(station, show_plot=False, return_png=True)
+
+    def dashboard():
+        PAGE_CACHE.clear()
+        dashboard_from_web()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Starting the pool and making the figures of its processes
+        start = time.perf_counter()
+        dashboard()
+        first_time = time.perf_counter() - start
+
+        separate_time = best_of(separately, 1, repeat=3)
+        dashboard_time = best_of(dashboard, 1, repeat=3)
+
+    tides.TIDE_INFO_WEBPAGE_TEMPLATE = template
+    server.shutdown()
+
+    print(f'9 stations, {POOL_PROCESSES} pool processes')
+    print(f'9 process_from_web         {separate_time * 1000:8.0f}ms')
+    print(f'dashboard                  {dashboard_time * 1000:8.0f}ms   ({separate_time / dashboard_time:.1f}x faster)')
+    print(f'first dashboard (new pool) {first_time * 1000:8.0f}ms')
+
+
+def load_test(render, urls, clients, duration=3.0):
+    """ Plots rendered per second by clients threads asking for the stations in turn """
+
+    done = []
+    stop = time.perf_counter() + duration
+
+    def client(k):
+        count = 0
+        while time.perf_counter() < stop:
+            station = list(urls)[(k + count) % len(urls)]
+            # The same page each time, so a 304 and the parsed series again
+            series = tide_series_from_web(urls[station], station)[4 * 24 * 4:]
+            if render(station, series) is not None:
+                count += 1
+        done.append(count)
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(done) / (time.perf_counter() - start)
+
+
+def bench_workers(number):
+
+    from tides import STATIONS
+
+    server = start_stub_server()
+    urls = {station: f'http://127.0.0.1:{server.server_port}/station/0?station={station}' for station in STATIONS}
+
+    def in_process(station, series):
+        return process(series, station, show_plot=False, all_five_days=True, return_png=True)
+
+    counts = sorted({count for count in (1, 2, 4, 8, WORKERS) if count <= max(WORKERS, 2)})
+
+    print(f'{os.cpu_count()} cores, concurrent requests rendering the plots of the stations in turn')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads_rate = load_test(in_process, urls, 2 * max(counts))
+    print(f'in the web process, {2 * max(counts)} threads {threads_rate:6.1f} plots/s')
+
+    for count in counts:
+        pool = RenderPool(count).start()
+        rate = load_test(pool.render, urls, 2 * count)
+        pool.shutdown()
+        print(f'{count} render workers, {2 * count} clients {rate:6.1f} plots/s   ({rate / threads_rate:.1f}x)')
+
+    server.shutdown()
+
+
+def bench_downsample(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+
+    full = TideRenderer(downsample=False)
+    downsampled = TideRenderer()
+
+    print(f'{"days":>6} {"readings":>9} {"all readings":>13} {"downsampled":>12}')
+
+    for days in (2, 30, 365, 5 * 365):
+        count = days * 24 * 4
+        long = TideSeries(series.times[0] + 900 * np.arange(count), np.resize(series.levels, count), 'Chelsea')
+        args = (london_datetime64(long.times), long.levels, long.speed, 'Thames at Chelsea', 'Now=2.3m')
+
+        # Rendering a few years of every reading takes seconds
+        full_time = best_of(lambda: full.render_png(*args), 1, repeat=1 if days > 30 else 3)
+        downsampled_time = best_of(lambda: downsampled.render_png(*args), 1, repeat=3)
+
+        print(f'{days:6} {count:9} {full_time * 1000:11.0f}ms {downsampled_time * 1000:10.0f}ms')
+
+    levels = np.resize(series.levels, 365 * 24 * 4)
+    indices_time = best_of(lambda: downsample_indices(levels, 1000), number)
+    print(f'downsample 1 year to 1000 buckets {indices_time * 1000:6.2f}ms')
+
+
+def bench_history(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+
+    day = 24 * 3600
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        os.chdir(directory)
+
+        # The old way to look at a past period: load the .dat file saved with it
+        save_to_file('Chelsea', series)
+        dat_time = best_of(lambda: load_file(os.listdir('.')[0]), number)
+
+        results = []
+        for years in (1, 5, 20):
+            count = years * 365 * 24 * 4
+            store = TideStore(f'store_{years}')
+            store.append(TideSeries(series.times[0] + 900 * np.arange(count), np.resize(series.levels, count),
+                                    'Chelsea'))
+
+            middle = int(series.times[0]) + count // 2 * 900
+            day_time = best_of(lambda: store.query('Chelsea', middle, middle + day), number * 10)
+            week_time = best_of(lambda: store.query('Chelsea', middle, middle + 7 * day), number * 10)
+            results.append((years, count, day_time, week_time))
+
+        os.chdir(cwd)
+
+    print(f'load one 5 day .dat file           {dat_time * 1000:8.3f}ms')
+    for years, count, day_time, week_time in results:
+        print(f'{years:2} years ({count:7} readings) 1 day {day_time * 1000:8.3f}ms   1 week {week_time * 1000:8.3f}ms')
+
+
+def bench_rollups(number):
+
+    series = tide_series_from_file(FIXTURE, 'Chelsea')
+
+    count = 365 * 24 * 4
+    year = TideSeries(series.times[0] + 900 * np.arange(count), np.resize(series.levels, count), 'Chelsea')
+
+    def summary(readings):
+        return (readings.max_level, readings.min_level, readings.mean_level, readings.max_rise_speed,
+                readings.max_fall_speed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TideStore(directory)
+        rollups = RollupStore(store)
+        store.append(year[:-1])
+
+        build_time = best_of(lambda: rollups.rebuild('Chelsea'), 1, repeat=3)
+
+        # What record_tide.py adds to each poll: the last hour and day again, and the tide table since its last turn
+        store.append(year)
+        update_time = best_of(lambda: rollups.update('Chelsea'), number)
+
+        raw_time = best_of(lambda: summary(store.query('Chelsea')), number)
+        rollup_time = best_of(lambda: summary(history('Chelsea', rollups=rollups)), number)
+        days = len(rollups.records('Chelsea'))
+
+    print(f'build the rollups of 1 year ({count} readings)  {build_time * 1000:8.3f}ms')
+    print(f'update them after a poll                       {update_time * 1000:8.3f}ms')
+    print(f'1 year summary from the readings               {raw_time * 1000:8.3f}ms')
+    print(f'1 year summary from the {days} daily rollups     {rollup_time * 1000:8.3f}ms   x{raw_time / rollup_time:.1f}')
+
+
+# Run in a fresh interpreter: import the Lambda, answer one request from the stub server, then a second one
+LAMBDA_COLD_START = """
+import sys, json, time, tempfile
+start = time.perf_counter()
+import application
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+application.TIDE_INFO_WEBPAGE_TEMPLATE = {url!r}
+application.page_cache.directory = tempfile.mkdtemp(dir='.')
+application.handler(None, None)
+responded = time.perf_counter()
+application.handler(None, None)
+warm = time.perf_counter() - responded
+print(json.dumps({{'import': imported - start, 'response': responded - start, 'warm': warm, 'heavy': heavy}}))
+"""
+
+
+def cold_start(args, cwd=None):
+    """ Wall time in seconds and output of a fresh python process """
+
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable] + args, cwd=cwd, capture_output=True, text=True, check=True).stdout
+
+    return time.perf_counter() - start, output
+
+
+def bench_startup(number):
+
+    runs = min(number, 5)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    interpreter_time = min(cold_start(['-c', 'pass'])[0] for _ in range(runs))
+    list_time = min(cold_start([os.path.join(here, 'tides.py'), '--list'])[0] for _ in range(runs))
+
+    heavy_code = f'import sys, tides; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    tides_heavy = cold_start(['-c', heavy_code], cwd=here)[1].strip()
+
+    server = start_stub_server()
+    url = f'http://127.0.0.1:{server.server_address[1]}/station/0?station={{station}}'
+    with tempfile.TemporaryDirectory() as directory:
+        # The handler saves under records/, as on Lambda
+        os.makedirs(os.path.join(directory, 'records'))
+        code = LAMBDA_COLD_START.format(heavy=HEAVY_MODULES, url=url)
+        env_path = os.path.abspath(LAMBDA_DIR)
+        lambda_runs = [json.loads(cold_start(['-c', f'import sys; sys.path.insert(0, {env_path!r})\n' + code],
+                                             cwd=directory)[1].splitlines()[-1])
+                       for _ in range(runs)]
+    server.shutdown()
+
+    lambda_import = min(run['import'] for run in lambda_runs)
+    lambda_response = min(run['response'] for run in lambda_runs)
+    lambda_warm = min(run['warm'] for run in lambda_runs)
+    lambda_heavy = lambda_runs[0]['heavy']
+
+    print(f'python -c pass                  {interpreter_time * 1000:7.0f}ms')
+    print(f'tides.py --list                 {list_time * 1000:7.0f}ms')
+    print(f'Lambda import application       {lambda_import * 1000:7.0f}ms')
+    print(f'Lambda first response           {lambda_response * 1000:7.0f}ms   (stub upstream, includes the import)')
+    print(f'Lambda warm invocation          {lambda_warm * 1000:7.2f}ms   (same data slot)')
+
+    for where, heavy in (('tides', tides_heavy), ('Lambda application', ','.join(lambda_heavy))):
+        if heavy:
+            print(f'REGRESSION: importing {where} loads {heavy}')
+
+
+# Pipeline stages, timed on each dataset and kept as a baseline to compare the next runs with
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'pipeline.json')
+REGRESSION_RATIO = 2.0  # Slower than the baseline by more than this is reported - runs vary by up to 50%
+MEASURE_BUDGET = 2.0  # s - a stage isn't repeated past this
+
+# Days of readings of the synthetic datasets, None for the saved page
+DATASETS = {'fixture': None, '5d': 5, '1m': 30, '1y': 365}
+PIPELINE_STAGES = ('parse', 'timestamps', 'stats', 'speed', 'render', 'base64', 'correlation', 'record', 'record_json')
+
+# Last reading of the synthetic pages, as on the saved page
+SYNTHETIC_END = int(datetime.datetime(2020, 1, 19, 10, tzinfo=datetime.timezone.utc).timestamp())
+
+STATION_ROW = '''                <tr>
+                  <td scope="row"><time datetime="{time}Z">{time}Z</time></td>
+                  <td class="numeric">{level:.3f}</td>
+                  <td>false</td>
+                </tr>
+'''
+
+
+def synthetic_page(station, days, seed=0):
+    """
+    Station page with days of readings every 15 minutes, latest first - the main constituents
+    with the tide coming later and higher up the river, and some noise
+    """
+
+    index = list(STATIONS).index(station)
+    rng = np.random.default_rng(seed + index)
+
+    times = SYNTHETIC_END - 900 * np.arange(days * 24 * 4)
+    hours = hours_since_reference(times) - 0.3 * index
+    levels = (0.5 + 0.05 * index + (2.0 + 0.15 * index) * np.cos(np.radians(CONSTITUENTS['M2']) * hours)
+              + 0.6 * np.cos(np.radians(CONSTITUENTS['S2']) * hours - 1.0)
+              + 0.3 * np.cos(np.radians(CONSTITUENTS['M4']) * hours - 2.0)
+              + rng.normal(0, 0.02, len(times)))
+
+    timestrings = times.astype('datetime64[s]').astype('datetime64[m]').astype(str)
+    rows = ''.join(STATION_ROW.format(time=time, level=level) for time, level in zip(timestrings, levels.tolist()))
+
+    return f'<html><body><table><tbody>\n{rows}            </tbody></table></body></html>\n'
+
+
+def dataset_pages(dataset):
+    """ station -> page of the dataset """
+
+    days = DATASETS[dataset]
+
+    if days is None:
+        with open(FIXTURE) as f:
+            return {'Chelsea': f.read()}
+
+    return {station: synthetic_page(station, days) for station in STATIONS}
+
+
+def measure(function, repeat=9, budget=MEASURE_BUDGET):
+    """ Best time in seconds of one call, fast functions called in loops, slow ones repeated less """
+
+    timer = timeit.Timer(function)
+    number, spent = timer.autorange()
+    best = spent / number
+
+    for _ in range(repeat - 1):
+        if spent > budget:
+            break
+        elapsed = timer.timeit(number)
+        spent += elapsed
+        best = min(best, elapsed / number)
+
+    return best
+
+
+def time_pipeline(pages):
+    """ Seconds of each stage over all the stations of the pages, and how many readings they had """
+
+    series = [tide_series_from_page(station, page) for station, page in pages.items()]
+    timestrings = [[time for time, _ in ROW_PATTERN.findall(page)] for page in pages.values()]
+
+    renderer = TideRenderer()
+    render_args = [(london_datetime64(s.times), s.levels, s.speed, STATIONS[s.station][1],
+                    f'Now={s.levels[-1]:.1f}m') for s in series]
+    pngs = [renderer.render_png(*args) for args in render_args]
+
+    # Along the river, or the station against itself 45 minutes later when it is alone
+    if len(series) > 1:
+        pairs = list(zip(series[:-1], series[1:]))
+    else:
+        pairs = [(series[0], TideSeries(series[0].times + 45 * 60, series[0].levels, 'Westminster'))]
+
+    def stats():
+        for s in series:
+            fresh = TideSeries(s.times, s.levels, s.station)
+            (fresh.max_level, fresh.min_level, fresh.mean_level, fresh.amplitude)
+
+    def speed():
+        for s in series:
+            fresh = TideSeries(s.times, s.levels, s.station)
+            (fresh.speed, fresh.max_rise_speed, fresh.max_fall_speed)
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        store = TideStore(directory)
+
+        def record():
+            # Into an empty store, as the first recording of the readings
+            for s in series:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(store.path(s.station))
+                store.append(s)
+
+        def record_json():
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                for s in series:
+                    save_to_file(s.station, s)
+            finally:
+                os.chdir(cwd)
+
+        stages = {'parse': lambda: [parse_columns(page) for page in pages.values()],
+                  'timestamps': lambda: [london_datetime64(decode_timestamps(t)) for t in timestrings],
+                  'stats': stats,
+                  'speed': speed,
+                  'render': lambda: [renderer.render_png(*args) for args in render_args],
+                  'base64': lambda: [base64.b64encode(png) for png in pngs],
+                  'correlation': lambda: [correlate(s1, s2, 6 * 60) for s1, s2 in pairs],
+                  'record': record,
+                  'record_json': record_json}
+
+        for name in PIPELINE_STAGES:
+            results[name] = measure(stages[name])
+
+    return results, sum(len(s) for s in series)
+
+
+def git_commit():
+    """ Short hash of HEAD, with -dirty when the code measured has uncommitted changes """
+
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty', '--abbrev=7'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(path):
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f'Couldn\'t read the baseline {path}: {e}')
+        return None
+
+
+def save_baseline(path, baseline, results, readings):
+    """ Replace the datasets that were run in the baseline, keep the others """
+
+    commit = git_commit()
+    date = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+    if commit is not None and commit.endswith('-dirty'):
+        print(f'Warning: uncommitted changes, the baseline is saved as measured on {commit}')
+
+    content = baseline or {'unit': 'seconds per call, all the stations of the dataset', 'datasets': {}}
+    content['python'] = platform.python_version()
+    content['machine'] = platform.platform()
+
+    for dataset, stages in results.items():
+        content['datasets'][dataset] = {'commit': commit, 'date': date, 'readings': readings[dataset],
+                                        'stages': stages}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(content, f, indent=1)
+
+    print(f'Saved the baseline as {path}')
+
+
+def bench_pipeline(number, datasets=None, baseline_path=BASELINE, save=False):
+    """
+    The stages from the station page to the stored readings, on the saved page and on 5 days,
+    1 month and 1 year for the 9 stations. Compared with the baseline - only meaningful when
+    saved on the same machine - and saved into it with save.
+    """
+
+    datasets = datasets or list(DATASETS)
+    baseline = load_baseline(baseline_path)
+
+    results = {}
+    readings = {}
+    for dataset in datasets:
+        results[dataset], readings[dataset] = time_pipeline(dataset_pages(dataset))
+
+    print(f'{"ms":12}' + ''.join(f'{dataset:>10}' for dataset in datasets))
+    print(f'{"readings":12}' + ''.join(f'{readings[dataset]:10}' for dataset in datasets))
+    for stage in PIPELINE_STAGES:
+        print(f'{stage:12}' + ''.join(f'{results[dataset][stage] * 1000:10.2f}' for dataset in datasets))
+
+    if baseline is not None:
+        saved = baseline['datasets']
+        print(f'\nagainst the baseline ({baseline["machine"]})')
+        print(f'{"commit":12}' + ''.join(f'{saved.get(dataset, {}).get("commit") or "-":>10}' for dataset in datasets))
+
+        regressions = []
+        for stage in PIPELINE_STAGES:
+            ratios = []
+            for dataset in datasets:
+                before = saved.get(dataset, {}).get('stages', {}).get(stage)
+                ratio = results[dataset][stage] / before if before else None
+                ratios.append(f'{ratio:9.2f}x' if ratio is not None else f'{"-":>10}')
+                if ratio is not None and ratio > REGRESSION_RATIO:
+                    regressions.append(f'REGRESSION: {stage} on {dataset} {ratio:.2f}x the baseline')
+            print(f'{stage:12}' + ''.join(ratios))
+
+        for regression in regressions:
+            print(regression)
+
+    if save:
+        save_baseline(baseline_path, baseline, results, readings)
+
+
+BENCHMARKS = {'parse': bench_parse,
+              'timestamps': bench_timestamps,
+              'fetch': bench_fetch,
+              'conditional': bench_conditional,
+              'store': bench_store,
+              'mongodb': bench_mongodb,
+              'correlation': bench_correlation,
+              'render': bench_render,
+              'startup': bench_startup,
+              'window': bench_window,
+              'events': bench_events,
+              'prediction': bench_prediction,
+              'pipeline': bench_pipeline,
+              'metrics': bench_metrics,
+              'dashboard': bench_dashboard,
+              'workers': bench_workers,
+              'downsample': bench_downsample,
+              'history': bench_history,
+              'rollups': bench_rollups}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Tides micro-benchmarks')
+    parser.add_argument('benchmarks', nargs='*', help=f'benchmarks to run (default all): {", ".join(BENCHMARKS)}')
+    parser.add_argument('--number', help='calls per timing', type=int, default=10)
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), help='datasets of the pipeline benchmark')
+    parser.add_argument('--baseline', help='pipeline baseline to compare with', default=BASELINE)
+    parser.add_argument('--save', help='save the pipeline results as the baseline', action='store_true')
+    args = parser.parse_args()
+
+    options = {'pipeline': {'datasets': args.datasets, 'baseline_path': args.baseline, 'save': args.save}}
+
+    for name in args.benchmarks or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.print_help(sys.stderr)
+            sys.exit(1)
+        print(f'=== {name}')
+        BENCHMARKS[name](args.number, **options.get(name, {}))
+
+
+if __name__ == '__main__':
+
+    main()
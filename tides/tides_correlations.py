@@ -3,17 +3,182 @@
 import sys
 import datetime
 import argparse
-import pandas as pd
-import matplotlib.pyplot as plt
-from tides import tide_data_generator_from_web, parse, TIDE_INFO_WEBPAGE_TEMPLATE, STATIONS
+import numpy as np
+from tides import tide_series_from_web_concurrently, STATIONS
+from tides_store import TideStore
+
+
+GRID_MINUTES = 15  # Step of the common time grid, the stations publish every 15 minutes
+MIN_OVERLAP = 0.5  # Shortest overlap of the shifted series, as a fraction of their length
+Z_95 = 1.96  # For the 95% confidence interval
+
+
+class LagCorrelation:
+    """
+    Correlation (%) of two stations for each time shift (minutes) of the second one.
+
+    best_lag_minutes is the best shift on the grid, lag_minutes the best shift refined
+    between grid points, with its 95% confidence interval (None when the best shift is
+    at the end of the range searched). The shifts are None when no correlation could be
+    computed, e.g. for a flat series.
+    """
+
+    def __init__(self, lags_minutes, correlations):
+
+        self.lags_minutes = lags_minutes
+        self.correlations = correlations
+
+        self.best_lag_minutes = None
+        self.best_correlation = float('nan')
+
+        if np.isfinite(correlations).any():
+            best = int(np.nanargmax(correlations))
+            self.best_lag_minutes = int(lags_minutes[best])
+            self.best_correlation = float(correlations[best])
+
+        self.lag_minutes = None if self.best_lag_minutes is None else float(self.best_lag_minutes)
+        self.peak_correlation = self.best_correlation
+        self.confidence_interval = None
+
+
+def series_to_dataframe(series):
+
+    # pandas is only needed to plot, not to correlate
+    import pandas as pd
+
+    # Merge on UTC, London time repeats an hour when BST ends
+    return pd.DataFrame({'Date': series.times.astype('datetime64[s]'), series.station: series.levels})
+
+
+def resample(series1, series2, step_minutes=GRID_MINUTES):
+    """ Times and levels of both series interpolated on a common grid where they overlap - empty when they don't """
+
+    step = step_minutes * 60
+    if len(series1) == 0 or len(series2) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+
+    start = -(-max(series1.times[0], series2.times[0]) // step) * step
+    end = min(series1.times[-1], series2.times[-1])
+    grid = np.arange(start, max(end + 1, start), step)
+
+    levels = []
+    for series in (series1, series2):
+        # Without the readings the station pages repeat
+        times, index = np.unique(series.times, return_index=True)
+        levels.append(np.interp(grid, times, series.levels[index].astype(float)))
+
+    return grid, levels[0], levels[1]
+
+
+def cross_correlation(a, b, max_lag):
+    """
+    Pearson correlation of a[i] and b[i - lag] for lag in [-max_lag, max_lag], over
+    the overlap of the two at each lag - all the lags in one go, with an FFT.
+    """
+
+    a = a - a.mean()
+    b = b - b.mean()
+    n = len(a)
+    lags = np.arange(-max_lag, max_lag + 1)
+
+    # Sums of a[i] * b[i - lag] from the circular cross-correlation, padded not to wrap around
+    size = 1 << (2 * n - 1).bit_length()
+    circular = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+    sum_ab = circular[lags % size]
+
+    # Sums over the overlap at each lag: a[max(lag, 0):n + min(lag, 0)] and b[max(-lag, 0):n - max(lag, 0)]
+    def overlap_sums(x, first, last):
+        cumulative = np.concatenate(([0.0], np.cumsum(x)))
+        return cumulative[last] - cumulative[first]
+
+    a_first, a_last = np.maximum(lags, 0), n + np.minimum(lags, 0)
+    b_first, b_last = np.maximum(-lags, 0), n - np.maximum(lags, 0)
+    count = a_last - a_first
+
+    sum_a, sum_aa = overlap_sums(a, a_first, a_last), overlap_sums(a * a, a_first, a_last)
+    sum_b, sum_bb = overlap_sums(b, b_first, b_last), overlap_sums(b * b, b_first, b_last)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlations = (count * sum_ab - sum_a * sum_b) / \
+            np.sqrt((count * sum_aa - sum_a ** 2) * (count * sum_bb - sum_b ** 2))
+
+    correlations[count < 2] = np.nan
+
+    return lags, correlations
+
+
+def refine_lag(lag_correlation, grid, levels1, levels2, step_minutes):
+    """
+    Sub grid lag from the vertex of the parabola through the correlation peak and its
+    neighbours, with a confidence interval from the width of the peak and the residual
+    noise - the Cramer-Rao bound of the delay, for errors with AR(1) autocorrelation.
+    """
+
+    best = int(np.nanargmax(lag_correlation.correlations))
+    if best == 0 or best == len(lag_correlation.correlations) - 1:
+        return
+
+    before, peak, after = lag_correlation.correlations[best - 1:best + 2] / 100
+    curvature = before - 2 * peak + after
+    if not curvature < 0:
+        return
+
+    offset = (before - after) / (2 * curvature)
+    lag = lag_correlation.best_lag_minutes + offset * step_minutes
+    correlation = min(peak - (before - after) * offset / 4, 1.0)
+
+    # Mean squared rate of change of the standardised levels (per minute^2), from the
+    # curvature of the correlation peak: r(lag) ~ r * (1 - omega2 * (lag - best)^2 / 2)
+    omega2 = -curvature / (step_minutes ** 2 * correlation)
+
+    # Residuals of the first station against the second one shifted by the lag
+    times = grid[(grid - lag * 60 >= grid[0]) & (grid - lag * 60 <= grid[-1])]
+    standardised1 = np.interp(times, grid, levels1)
+    standardised2 = np.interp(times - lag * 60, grid, levels2)
+    standardised1 = (standardised1 - standardised1.mean()) / standardised1.std()
+    standardised2 = (standardised2 - standardised2.mean()) / standardised2.std()
+    residuals = standardised1 - correlation * standardised2
+
+    # Consecutive residuals aren't independent, count fewer samples
+    autocorrelation = np.corrcoef(residuals[:-1], residuals[1:])[0, 1] if residuals.std() > 0 else 0.0
+    autocorrelation = min(max(autocorrelation, 0.0), 0.99)
+    samples = len(times) * (1 - autocorrelation) / (1 + autocorrelation)
+
+    variance = (1 - correlation ** 2) / (samples * correlation ** 2 * omega2)
+    half_width = Z_95 * np.sqrt(variance)
+
+    lag_correlation.lag_minutes = float(lag)
+    lag_correlation.peak_correlation = float(correlation * 100)
+    lag_correlation.confidence_interval = (float(lag - half_width), float(lag + half_width))
+
+
+def correlate(series1, series2, max_lag_minutes=6 * 60, step_minutes=GRID_MINUTES):
+    """ LagCorrelation of the two series for shifts up to max_lag_minutes either way """
+
+    grid, levels1, levels2 = resample(series1, series2, step_minutes)
+    if len(grid) < 2:
+        # No overlap: nothing to correlate, not even without a shift
+        return LagCorrelation(np.zeros(1, dtype=np.int64), np.full(1, np.nan))
+
+    # Don't trust correlations over too short an overlap
+    max_lag = min(max_lag_minutes // step_minutes, int(len(grid) * (1 - MIN_OVERLAP)))
+
+    lags, correlations = cross_correlation(levels1, levels2, max_lag)
+
+    lag_correlation = LagCorrelation(lags * step_minutes, correlations * 100)
+    # All NaN for a flat series or too short an overlap
+    if lag_correlation.best_lag_minutes is not None:
+        refine_lag(lag_correlation, grid, levels1, levels2, step_minutes)
+
+    return lag_correlation
 
 
 def get_correlation_with_shift(df1, df2, delta_mins, plot=False, message=None):
 
-    df2_shifted = df2.copy()
+    import pandas as pd
 
-    for ix in df2_shifted.index:
-        df2_shifted['Date'][ix] += pd.Timedelta(minutes=delta_mins)
+    df2_shifted = df2.copy()
+    df2_shifted['Date'] += pd.Timedelta(minutes=delta_mins)
 
     df2_shifted.columns = [df2_shifted.columns[0], df2_shifted.columns[1] + ' (shifted)']
 
@@ -22,6 +187,8 @@ def get_correlation_with_shift(df1, df2, delta_mins, plot=False, message=None):
     df_all = df_all.merge(df2, how='inner', on='Date')
 
     if plot:
+        import matplotlib.pyplot as plt
+
         title = 'Tide Level'
         if message is not None:
             title += '\n' + message
@@ -34,31 +201,38 @@ def get_correlation_with_shift(df1, df2, delta_mins, plot=False, message=None):
     return correlation
 
 
-def process(station1, station2):
-
-    dfs = []
+def process(station1, station2, max_lag_minutes=6 * 60, from_store=False, show_plot=True):
 
-    for station in (station1, station2):
-        tide_info_page = TIDE_INFO_WEBPAGE_TEMPLATE.format(station=STATIONS[station][0])
+    if from_store:
+        store = TideStore()
+        series = {station: store.query(station) for station in (station1, station2)}
+    else:
+        series = dict(tide_series_from_web_concurrently((station1, station2)))
 
-        df = pd.DataFrame(tide_data_generator_from_web(tide_info_page), columns=['Date', station])
+    if any(len(series[station]) < 2 for station in (station1, station2)):
+        print(f'Error: Not enough data for {station1} and {station2}!')
+        return
 
-        dfs.append(df)
+    # e.g. histories recorded over different periods
+    grid, _, _ = resample(series[station1], series[station2])
+    if len(grid) < 2:
+        print(f'Error: Not enough overlapping data for {station1} and {station2}!')
+        return
 
-    df_all = pd.merge(dfs[0], dfs[1], how='inner', on='Date')
+    lag_correlation = correlate(series[station1], series[station2], max_lag_minutes)
 
-    correlation = df_all.corr()[station1][station2] * 100.0
+    for delta_mins, correlation_with_shift in zip(lag_correlation.lags_minutes, lag_correlation.correlations):
+        print(f'{delta_mins:3} mins ---> {correlation_with_shift:.1f}% correlation')
 
-    shift2correlation = dict()
+    correlation = lag_correlation.correlations[len(lag_correlation.lags_minutes) // 2]
 
-    # Magic numbers here - iterate the range plus/minus 6 hours with a 15 mins step
-    for delta_mins in range(- 15 * 4 * 6, 15 * 4 * 6, 15):
-        correlation_with_shift = get_correlation_with_shift(dfs[0], dfs[1], delta_mins)
-        shift2correlation[correlation_with_shift] = delta_mins
-        print(f'{delta_mins:3} mins ---> {correlation_with_shift:.1f}% correlation')
+    if lag_correlation.lag_minutes is None:
+        print(f'Correlation {correlation:.2f}%')
+        print(f'Error: No correlation between {station1} and {station2}, is one of them flat?')
+        return
 
-    max_correlation = max(shift2correlation.keys())
-    delta_mins_max_correlation = shift2correlation[max_correlation]
+    max_correlation = lag_correlation.peak_correlation
+    delta_mins_max_correlation = round(lag_correlation.lag_minutes)
 
     time_delta = f'{abs(delta_mins_max_correlation) // 60}h{abs(delta_mins_max_correlation) % 60}m'
     time_delta = f'-{time_delta}' if delta_mins_max_correlation < 0 else time_delta
@@ -66,9 +240,16 @@ def process(station1, station2):
     print(f'Correlation {correlation:.2f}%')
     print(f'Max correlation {max_correlation:.1f}% for time shift of {time_delta}')
 
-    message = f'{time_delta} between peak tides at {station1} and {station2}'
+    if lag_correlation.confidence_interval is not None:
+        low, high = lag_correlation.confidence_interval
+        print(f'Time shift {lag_correlation.lag_minutes:.1f} mins, 95% confidence interval {low:.1f} to {high:.1f} mins')
+
+    if show_plot:
+        message = f'{time_delta} between peak tides at {station1} and {station2}'
 
-    get_correlation_with_shift(dfs[0], dfs[1], delta_mins_max_correlation, plot=True, message=message)
+        # Shifted by the best lag on the grid, the readings are 15 minutes apart
+        dfs = [series_to_dataframe(series[station]) for station in (station1, station2)]
+        get_correlation_with_shift(dfs[0], dfs[1], lag_correlation.best_lag_minutes, plot=True, message=message)
 
 
 def main():
@@ -78,6 +259,8 @@ def main():
     parser.add_argument('--station1', help='station 1')
     parser.add_argument('--station2', help='station 2')
     parser.add_argument('--noplot', help='do not show the plot on screen', action='store_true')
+    parser.add_argument('--hours', help='largest time shift to try, either way (default 6)', type=int, default=6)
+    parser.add_argument('--store', help='use the recorded history rather than the web pages', action='store_true')
     parser.add_argument('--save', help='save to file', action='store_true')
     args = parser.parse_args()
 
@@ -100,7 +283,7 @@ def main():
         station1 = 'Chelsea'
         station2 = 'Dover'
 
-    process(station1, station2)
+    process(station1, station2, args.hours * 60, args.store, show_plot)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,118 @@
+"""
+Render worker processes, so plots are drawn on all the cores and out of the web process.
+
+The workers import matplotlib and draw a plot before the first request. A series goes to
+them as its two arrays and the PNG bytes come back. A slow render holds only its worker. The stage timings of the worker come back with the PNG,
+for the metrics of the web process.
+"""
+
+import os
+import threading
+import concurrent.futures
+import numpy as np
+from tides_series import TideSeries
+from tides_metrics import METRICS
+
+
+WORKERS = os.cpu_count() or 1
+MAX_PENDING_PER_WORKER = 4  # Renders queued per worker before submitting waits
+RENDER_TIMEOUT = 60  # s
+
+
+def warm_up():
+    """ Initializer of the workers - what the first render would otherwise pay for """
+
+    from tides_render import TideRenderer
+    from tides import london_datetime64
+
+    times = 1_600_000_000 + 900 * np.arange(96)
+    levels = np.sin(np.arange(96) / 8).astype(np.float32)
+    TideRenderer().render_png(london_datetime64(times), levels, np.diff(levels), 'Warming up', 'Now=0.0m')
+
+
+def render_series(station, times, levels):
+    """ (PNG bytes of the plot of the readings, (stage, seconds) it took) - runs in the workers """
+
+    from tides import plot
+
+    METRICS.start_trace()
+    try:
+        png = plot(station, TideSeries(times, levels, station), show_plot=False, save_to_file=False, return_png=True)
+    finally:
+        trace = METRICS.end_trace()
+
+    return png, trace
+
+
+class RenderPool:
+    """
+    A fixed number of render worker processes. They are forked by start(), all at once:
+    call it before starting threads.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=None):
+
+        self.workers = workers
+        self.executor = None
+        self.pending = threading.BoundedSemaphore(max_pending or workers * MAX_PENDING_PER_WORKER)
+
+    def start(self):
+        """ Start the workers and wait until they are warm """
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+
+        # A task only runs once its worker has warmed up
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+        return self
+
+    def submit(self, function, *args):
+        """ Future of function(*args) in a worker - waits while too many renders are queued """
+
+        executor = self.executor
+        if executor is None:
+            raise RuntimeError('Render pool not started')
+
+        self.pending.acquire()
+
+        try:
+            future = executor.submit(function, *args)
+        except Exception:
+            self.pending.release()
+            raise
+
+        future.add_done_callback(lambda _: self.pending.release())
+
+        return future
+
+    def render(self, station, series, timeout=RENDER_TIMEOUT):
+        """ PNG bytes of the plot of the series, None when it couldn't be rendered in time """
+
+        future = self.submit(render_series, station, series.times, series.levels)
+
+        try:
+            png, trace = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            METRICS.error('render')
+            print(f'Couldn\'t render {station} in {timeout}s')
+            return None
+        except Exception as e:
+            METRICS.error('render')
+            print(f'Couldn\'t render {station}: {e}')
+            return None
+
+        # Timed in the worker, its metrics are not served
+        for stage, seconds in trace:
+            METRICS.observe(stage, seconds)
+
+        if png is not None:
+            METRICS.add_bytes('render', len(png))
+
+        return png
+
+    def shutdown(self):
+
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,229 @@
+"""
+The tide plot, built once per station and redrawn with new data.
+
+Plain Agg figures, outside the pyplot global state: nothing to close and no
+limit on figures open, and renders on different figures can run in parallel.
+"""
+
+import io
+import threading
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.collections import PolyCollection
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+FIGSIZE = (20, 10)
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+# Colors from http://ksrowell.com/blog-visualizing-data/2012/02/02/optimal-colors-for-graphs/
+WATER_COLOR = '#396AB1'
+TIDE_RISE_COLOR = '#DA7C30'
+TITLE_COLOR = '#535154'
+BOX_BACKGROUND_COLOR = '#CCC210'
+
+TITLE_FONT = {'family': 'serif',
+              'color': TITLE_COLOR,
+              'weight': 'bold',
+              'size': 24, }
+
+PIXELS_PER_BUCKET = 2  # Longer series are drawn as the min and max of buckets of about this many pixels
+
+
+def downsample_indices(values, buckets):
+    """
+    Indices of the min and the max of values in each of about buckets equal runs, in order -
+    the peaks and troughs stay, however many values there are. All of them when they are few.
+    """
+
+    count = len(values)
+    if count <= 2 * buckets:
+        return np.arange(count)
+
+    size = -(-count // buckets)
+    rows = -(-count // size)
+
+    # Rows of size values, the last one padded so the padding is never picked
+    padded = np.empty(rows * size, dtype=np.float64)
+    padded[:count] = values
+    padded[count:] = np.inf
+    lowest = np.argmin(padded.reshape(rows, size), axis=1)
+    padded[count:] = -np.inf
+    highest = np.argmax(padded.reshape(rows, size), axis=1)
+
+    starts = np.arange(rows) * size
+    indices = np.concatenate((starts + np.minimum(lowest, highest), starts + np.maximum(lowest, highest),
+                              [0, count - 1]))
+
+    return np.unique(indices)
+
+
+def band(x, values, buckets):
+    """
+    Polygon between the min and the max of values in each of about buckets equal runs, from
+    the first x of each run to the last x - one filled shape instead of a line zigzagging
+    between the peaks and troughs, a few times faster for Agg to draw
+    """
+
+    count = len(values)
+    size = -(-count // buckets)
+    rows = -(-count // size)
+
+    padded = np.empty(rows * size, dtype=np.float64)
+    padded[:count] = values
+    padded[count:] = np.inf
+    lowest = padded.reshape(rows, size).min(axis=1)
+    padded[count:] = -np.inf
+    highest = padded.reshape(rows, size).max(axis=1)
+
+    # Each run up to the start of the next one, the last one up to the last x
+    x = np.asarray(x, dtype=np.float64)
+    edges = np.append(x[::size], x[-1])
+    lowest, highest = np.append(lowest, lowest[-1]), np.append(highest, highest[-1])
+
+    return np.concatenate((np.column_stack((edges, highest)), np.column_stack((edges[::-1], lowest[::-1]))))
+
+
+class TideRenderer:
+    """
+    Water level and tide rise speed plot. Only the lines, the markers on the last
+    readings, the title and the info box change between renders. Renders on the same
+    renderer are serialised with a lock.
+
+    Series longer than the figure has pixels for are drawn as a band between the min and
+    max of each few pixels, without a marker on each reading, so a render takes about the
+    same time whatever the time range.
+    """
+
+    def __init__(self, figure=None, downsample=True):
+
+        # A pyplot figure can be passed in to show the plot on screen
+        if figure is None:
+            figure = Figure(figsize=FIGSIZE)
+            FigureCanvasAgg(figure)
+
+        self.figure = figure
+        self.lock = threading.Lock()
+        self.downsample = downsample
+
+        plot = figure.add_subplot(111)
+        plot.xaxis_date()
+
+        self.levels_line, = plot.plot([], [], WATER_COLOR, marker='.', linewidth=3.0, label='Water level')
+        self.forecast_line, = plot.plot([], [], WATER_COLOR, linestyle='--', linewidth=2.0, label='Forecast')
+        plot.set_ylabel('Water level (m)', color=WATER_COLOR, fontweight='bold', fontsize=22)
+
+        plot2 = plot.twinx()
+
+        self.speed_line, = plot2.plot([], [], TIDE_RISE_COLOR, marker='.', linewidth=0.5, label='Tide rise speed')
+
+        # Instead of the lines when downsampled
+        self.levels_band = plot.add_collection(PolyCollection([], facecolors=WATER_COLOR, linewidths=0),
+                                               autolim=False)
+        self.speed_band = plot2.add_collection(PolyCollection([], facecolors=TIDE_RISE_COLOR, linewidths=0),
+                                               autolim=False)
+        plot2.set_ylabel('Tide rise speed (cm/min)', color=TIDE_RISE_COLOR, fontweight='bold', fontsize=22)
+
+        # Grid
+        plot.axhline(linewidth=1, color='r')
+        plot.grid(color='g', linestyle=':', linewidth=0.5)
+
+        plot.format_xdata = mdates.DateFormatter(DATE_FORMAT)
+        plot2.format_xdata = mdates.DateFormatter(DATE_FORMAT)
+        plot.xaxis.set_major_formatter(mdates.DateFormatter(DATE_FORMAT))
+
+        # Mark the last point on each graph
+        self.last_level, = plot.plot([], [], 'o', markersize=20, color=WATER_COLOR)
+        self.last_speed, = plot2.plot([], [], 'o', markersize=20, color=TIDE_RISE_COLOR)
+
+        self.title = plot2.set_title('', fontdict=TITLE_FONT)
+
+        # Info about levels - at the first reading, zero tide rise speed
+        self.level_info_box = plot2.text(0, 0, '', fontsize=32)
+        self.level_info_box.set_bbox(dict(facecolor=BOX_BACKGROUND_COLOR, alpha=1, edgecolor=BOX_BACKGROUND_COLOR))
+
+        # Legend - the water one is made on each draw, with the forecast only when there's one
+        plot2.legend(loc='upper right', fontsize='x-large')
+
+        self.plot = plot
+        self.plot2 = plot2
+
+    def draw(self, dates, levels, speed, title, info, forecast_dates=(), forecast_levels=()):
+        """
+        Put the data in the figure - dates (datetime64) of the levels, speed between them,
+        and the forecast levels after the last one, dashed
+        """
+
+        x = mdates.date2num(np.asarray(dates, dtype='datetime64[s]'))
+        forecast_x = mdates.date2num(np.asarray(forecast_dates, dtype='datetime64[s]'))
+
+        self.forecast_line.set_data(forecast_x, forecast_levels)
+        handles = [self.levels_line, self.forecast_line] if len(forecast_x) else [self.levels_line]
+        self.plot.legend(handles=handles, loc='upper left', fontsize='x-large')
+
+        buckets = int(self.figure.get_figwidth() * self.figure.dpi / PIXELS_PER_BUCKET)
+        if self.downsample and len(x) > 2 * buckets:
+            levels_band, speed_band = band(x, levels, buckets), band(x[:-1], speed, buckets)
+            self.levels_line.set_data([], [])
+            self.speed_line.set_data([], [])
+            marker = ''
+        else:
+            levels_band = speed_band = np.empty((0, 2))
+            self.levels_line.set_data(x, levels)
+            self.speed_line.set_data(x[:-1], speed)
+            marker = '.'
+
+        self.levels_band.set_verts([levels_band])
+        self.speed_band.set_verts([speed_band])
+        self.levels_line.set_marker(marker)
+        self.speed_line.set_marker(marker)
+        self.last_level.set_data(x[-1:], levels[-1:])
+        self.last_speed.set_data(x[-2:-1], speed[-1:])
+
+        # relim() only looks at the lines, not the bands
+        for axes, vertices in ((self.plot, levels_band), (self.plot2, speed_band)):
+            axes.relim()
+            axes.update_datalim(vertices)
+            axes.autoscale_view()
+
+        self.title.set_text(title)
+        self.level_info_box.set_text(info)
+        self.level_info_box.set_position((x[0], 0))
+
+        # Rotate the x axis to avoid overlapping
+        for label in self.plot.get_xticklabels():
+            label.set_rotation(30)
+            label.set_ha('right')
+            label.set_fontsize(12)
+
+    def save(self, filename, dpi=None, format=None):
+
+        self.figure.savefig(filename, dpi=dpi, format=format)
+
+    def render_png(self, dates, levels, speed, title, info, forecast_dates=(), forecast_levels=(), dpi=None):
+        """ PNG bytes of the plot of the data """
+
+        with self.lock:
+            self.draw(dates, levels, speed, title, info, forecast_dates, forecast_levels)
+
+            image_bytes = io.BytesIO()
+            self.save(image_bytes, dpi=dpi, format='png')
+
+        return image_bytes.getvalue()
+
+
+# station -> TideRenderer
+RENDERERS: dict = {}
+RENDERERS_LOCK = threading.Lock()
+
+
+def get_renderer(station):
+    """ The renderer kept for the station, created on first use """
+
+    with RENDERERS_LOCK:
+        renderer = RENDERERS.get(station)
+        if renderer is None:
+            renderer = RENDERERS[station] = TideRenderer()
+
+    return renderer
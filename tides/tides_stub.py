@@ -0,0 +1,68 @@
+"""
+Local stand-in for the gov web site, serving the saved station page - for the benchmarks and the tests
+"""
+
+import os
+import time
+import threading
+import http.server
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test', 'Thames_Tide.html')
+
+
+class StubServer(http.server.ThreadingHTTPServer):
+    """ Serves the page to the StubStationHandler requests """
+
+    daemon_threads = True
+    page = b''
+
+
+class StubStationHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the saved station page after the delay in ms at the end of the path, e.g. /station/250
+    (a query string is ignored).
+    Pages under /station/ have an ETag, pages under /plain/ don't.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    etag = '"Thames_Tide"'
+    server: StubServer
+
+    def do_GET(self):
+
+        time.sleep(int(self.path.split('?')[0].rsplit('/', 1)[-1]) / 1000)
+
+        with_etag = self.path.startswith('/station/')
+
+        if with_etag and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+
+        body = self.server.page
+        self.send_response(200)
+        if with_etag:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        pass
+
+
+def start_stub_server(handler=StubStationHandler):
+    """ Local stand-in for the gov web site, call shutdown() on it when done """
+
+    server = StubServer(('127.0.0.1', 0), handler)
+
+    with open(FIXTURE, 'rb') as f:
+        server.page = f.read()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -1,12 +1,34 @@
-from flask import Flask, send_from_directory
-from tides import process_from_web
+import os
+import time
+import functools
+from flask import Flask, jsonify, request
+from tides import STATIONS, epoch_from_date
+from tides_metrics import METRICS, CONTENT_TYPE
+from render_cache import RenderCache
+from tides_pool import RenderPool, WORKERS
+from tides_dashboard import start_pool
+from tides_store import TideStore, STORE_DIR
+from tides_rollup import RollupStore, PERIODS, DAY
+from series_api import (load_series, load_events, load_plot, load_dashboard, load_history, load_rollups,
+                        load_tide_table)
 
 
 # EB looks for an 'application' callable by default.
-application = Flask(__name__, static_url_path='')
+application = Flask(__name__, static_url_path='', static_folder='web/static')
 
 SITE = 'Westminster'
 
+# Log where the time of each request went, e.g. TIDES_LOG_TIMINGS=1 python application.py
+LOG_TIMINGS = os.environ.get('TIDES_LOG_TIMINGS') == '1'
+
+# Where record_tide.py keeps the readings and their rollups, for /api/history
+store = TideStore(os.environ.get('TIDES_STORE_DIR', STORE_DIR))
+rollups = RollupStore(store)
+MAX_HOURLY_DAYS = 366  # Longest range of ?period=hourly, longer ones by day
+
+# Processes rendering the plots, one per core by default - 0 to render on the request threads
+RENDER_WORKERS = int(os.environ.get('TIDES_RENDER_WORKERS', WORKERS))
+
 page = """<!doctype html>
 <html>
 <head>
@@ -15,23 +37,222 @@ page = """<!doctype html>
 </head>
 <body bgcolor="white">
 <p align="center">
-<img src="data:image/png;base64, {image}" style="width: 100%" alt="tide"/>
+<img src="{image}" style="width: 100%" alt="tide"/>
 </p>
 <button onclick="location.reload(true);" style="font-size:32px">Refresh <i class="fa fa-refresh"></i></button>
 </body>
 </html>"""
 
 
+# Forked before the cache threads start - the dashboard panels are rendered by the render
+# workers, else by the panel renderers of tides_dashboard, forked now too
+render_pool = RenderPool(RENDER_WORKERS).start() if RENDER_WORKERS else None
+dashboard_pool = render_pool or start_pool()
+
+# Rendered plots by (station, all_five_days)
+render_cache = RenderCache(functools.partial(load_plot, pool=render_pool))
+render_cache.start()
+
+# Plot of all the stations by all_five_days
+dashboard_cache = RenderCache(functools.partial(load_dashboard, pool=dashboard_pool))
+dashboard_cache.start()
+
+# Series payloads by (station, all_five_days)
+series_cache = RenderCache(load_series)
+series_cache.start()
+
+# High and low waters by station
+events_cache = RenderCache(load_events)
+events_cache.start()
+
+
 @application.route('/')
 def process():
-    base64_content = process_from_web(SITE, show_plot=False, save_to_file=True, all_five_days=False,
-                      save_plot_png=True, return_base64=True)
-    return page.format(site=SITE, image=base64_content.decode("utf-8"))
+    # The image comes with its own request, from the cache filled here
+    if render_cache.get(SITE, False) is None:
+        return f'No tide data for {SITE} at the moment, try again later.', 503
+    return page.format(site=SITE, image=f'/plot/{SITE}.png')
+
+
+CACHES = {'plots': render_cache, 'dashboard': dashboard_cache, 'series': series_cache, 'events': events_cache}
+
+
+@application.route('/cache')
+def cache_stats():
+    return jsonify({name: cache.stats() for name, cache in CACHES.items()})
+
+
+@application.route('/metrics')
+def metrics():
+    """ Stage latencies, bytes and errors, and the cache counters, for Prometheus to scrape """
+    stats = {name: cache.stats() for name, cache in CACHES.items()}
+
+    lines = []
+    for counter in ('hits', 'stale_hits', 'misses', 'refreshes', 'errors'):
+        lines.append(f'# TYPE tides_cache_{counter}_total counter')
+        lines += [f'tides_cache_{counter}_total{{cache="{name}"}} {cache_stats[counter]}'
+                  for name, cache_stats in stats.items()]
+
+    return application.response_class(METRICS.exposition() + '\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
+
+
+@application.before_request
+def start_timings():
+    if LOG_TIMINGS:
+        METRICS.start_trace()
+
+
+@application.after_request
+def log_timings(response):
+    if LOG_TIMINGS:
+        # Only what ran on the request thread - a cache hit runs no stage
+        totals = {}
+        for stage, seconds in METRICS.end_trace():
+            totals[stage] = totals.get(stage, 0) + seconds
+        timings = ' '.join(f'{stage}={seconds * 1000:.1f}ms' for stage, seconds in totals.items())
+        print(f'{request.method} {request.full_path.rstrip("?")} {response.status_code} {timings or "no stage"}')
+    return response
+
+
+def cached_response(cache, payload, binary=False):
+    """
+    The payload with its ETag and the time of its latest reading as Last-Modified, cacheable
+    until the next reading is due - 304 when not modified
+    """
+    content, content_type, etag = payload.body(binary)
+
+    response = application.response_class(content, content_type=content_type)
+    response.set_etag(etag.strip('"'))
+    response.last_modified = payload.observed
+
+    # Good until the reading after the latest is published, or the next slot when it is late
+    now = time.time()
+    expires = payload.observed + cache.period + cache.delay
+    if expires <= now:
+        expires = cache.next_publication(now)
+    response.cache_control.public = True
+    response.cache_control.max_age = int(expires - now)
+
+    return response.make_conditional(request)
+
+
+def unknown_station(station):
+    return jsonify({'error': f'Unknown station {station}', 'stations': list(STATIONS)}), 404
+
+
+def no_data(station):
+    return jsonify({'error': f'No tide data for {station} at the moment, try again later.'}), 503
+
+
+@application.route('/api/series/<station>')
+def series(station):
+    """ ?format=bin for the packed binary instead of JSON, ?days=5 for all five days """
+    if station not in STATIONS:
+        return unknown_station(station)
+
+    payload = series_cache.get(station, request.args.get('days') == '5')
+    if payload is None:
+        return no_data(station)
+
+    return cached_response(series_cache, payload, binary=request.args.get('format') == 'bin')
+
+
+@application.route('/api/history/<station>')
+def history(station):
+    """
+    Recorded readings from ?from= to ?to= (YYYY-MM-DD[THH:MM], UTC, to excluded), by default
+    the latest - as /api/series, ?format=bin for the packed binary. Over 14 days, the min and
+    max of each hour, over 92 days of each day, as tides.py --from does. ?period=hourly or
+    daily for the min, max, mean and largest speeds of the hours or London days starting in
+    the range, hourly over MAX_HOURLY_DAYS at most
+    """
+    if station not in STATIONS:
+        return unknown_station(station)
+
+    if request.args.get('from') is None:
+        return jsonify({'error': 'The start of the range is needed: ?from=YYYY-MM-DD[THH:MM]'}), 400
+
+    try:
+        start, end = epoch_from_date(request.args.get('from')), epoch_from_date(request.args.get('to'))
+    except ValueError as e:
+        return jsonify({'error': f'Bad date: {e}'}), 400
+
+    period = request.args.get('period')
+    if period is not None:
+        if period not in PERIODS:
+            return jsonify({'error': f'Unknown period {period}', 'periods': list(PERIODS)}), 400
+        if period == 'hourly' and (end or time.time()) - start > MAX_HOURLY_DAYS * DAY:
+            return jsonify({'error': f'Over {MAX_HOURLY_DAYS} days, ask for ?period=daily'}), 400
+        payload = load_rollups(station, period, start, end, rollups)
+    else:
+        payload = load_history(station, start, end, rollups)
+    if payload is None:
+        return jsonify({'error': f'No readings of {station} recorded in the range'}), 404
+
+    return cached_response(series_cache, payload, binary=request.args.get('format') == 'bin')
+
+
+@application.route('/api/events/<station>')
+def events(station):
+    """
+    High and low waters (slack water) over the last five days, as JSON - or the recorded ones
+    from ?from= to ?to=, as /api/history
+    """
+    if station not in STATIONS:
+        return unknown_station(station)
+
+    if 'from' in request.args or 'to' in request.args:
+        try:
+            start, end = epoch_from_date(request.args.get('from')), epoch_from_date(request.args.get('to'))
+        except ValueError as e:
+            return jsonify({'error': f'Bad date: {e}'}), 400
+
+        payload = load_tide_table(station, start, end, rollups)
+        if payload is None:
+            return jsonify({'error': f'No high or low water of {station} recorded in the range'}), 404
+
+        return cached_response(events_cache, payload)
+
+    payload = events_cache.get(station)
+    if payload is None:
+        return no_data(station)
+
+    return cached_response(events_cache, payload)
+
+
+@application.route('/plot/<station>.png')
+def plot(station):
+    """ The plot of the last 2 days, ?days=5 for all five """
+    if station not in STATIONS:
+        return unknown_station(station)
+
+    payload = render_cache.get(station, request.args.get('days') == '5')
+    if payload is None:
+        return no_data(station)
+
+    return cached_response(render_cache, payload)
 
 
 @application.route('/plot.png')
 def root():
-    return send_from_directory(application.root_path, 'plot.png')
+    return plot(SITE)
+
+
+@application.route('/dashboard')
+def dashboard():
+    if dashboard_cache.get(False) is None:
+        return 'No tide data at the moment, try again later.', 503
+    return page.format(site='all stations', image='/dashboard.png')
+
+
+@application.route('/dashboard.png')
+def dashboard_plot():
+    """ All the stations on one image, over the last 2 days - ?days=5 for all five """
+    payload = dashboard_cache.get(request.args.get('days') == '5')
+    if payload is None:
+        return jsonify({'error': 'No tide data at the moment, try again later.'}), 503
+
+    return cached_response(dashboard_cache, payload)
 
 
 def main():
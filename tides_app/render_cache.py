@@ -0,0 +1,135 @@
+"""
+Cache of the rendered tide plots, refreshed in the background when new data is due
+"""
+
+import time
+import threading
+
+
+PUBLICATION_MINUTES = 15  # The stations publish a reading every 15 minutes
+PUBLICATION_DELAY = 60  # Seconds after the quarter hour when the new reading is expected online
+MAX_STALE_PERIODS = 4  # Render on the request rather than serve a value older than so many periods
+
+
+class Entry:
+
+    def __init__(self, value, rendered_at, expires_at):
+
+        self.value = value
+        self.rendered_at = rendered_at
+        self.expires_at = expires_at
+
+
+class RenderCache:
+    """
+    Values of render(*key) - e.g. render(station, all_five_days) - kept until the next
+    upstream publication slot. A background thread renders again once the slot has
+    passed and until then requests keep getting the previous value, so only the very
+    first request for a key waits on scraping and rendering.
+    """
+
+    def __init__(self, render, period=PUBLICATION_MINUTES * 60, delay=PUBLICATION_DELAY):
+
+        self.render = render
+        self.period = period
+        self.delay = delay
+
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def next_publication(self, now):
+        """ Epoch seconds of the first publication slot after now """
+
+        return (now - self.delay) // self.period * self.period + self.period + self.delay
+
+    def start(self):
+
+        refresher = threading.Thread(target=self.refresh_forever, name='render-cache-refresher', daemon=True)
+        refresher.start()
+
+        return refresher
+
+    def get(self, *key):
+
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now >= entry.rendered_at + MAX_STALE_PERIODS * self.period:
+                self.misses += 1
+                entry = None
+            elif now >= entry.expires_at:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+
+        if entry is None:
+            entry = self.update(key)
+
+        return entry.value if entry is not None else None
+
+    def update(self, key):
+
+        try:
+            value = self.render(*key)
+        except Exception as e:
+            print(f'Error: Couldn\'t render {key}: {e}')
+            value = None
+
+        if value is None:
+            with self.lock:
+                self.errors += 1
+            return None
+
+        now = time.time()
+        entry = Entry(value, now, self.next_publication(now))
+
+        with self.lock:
+            self.entries[key] = entry
+
+        # The refresher may be sleeping without knowing about this key
+        self.wakeup.set()
+
+        return entry
+
+    def refresh_forever(self):
+
+        while True:
+            with self.lock:
+                due = min((entry.expires_at for entry in self.entries.values()), default=None)
+
+            self.wakeup.wait(None if due is None else max(0.0, due - time.time()))
+            self.wakeup.clear()
+
+            with self.lock:
+                expired = [key for key, entry in self.entries.items() if entry.expires_at <= time.time()]
+
+            for key in expired:
+                if self.update(key) is not None:
+                    with self.lock:
+                        self.refreshes += 1
+                else:
+                    # Try again in a minute rather than keep hammering the web site
+                    with self.lock:
+                        self.entries[key].expires_at = time.time() + 60
+
+    def stats(self):
+
+        now = time.time()
+
+        with self.lock:
+            return {'hits': self.hits,
+                    'stale_hits': self.stale_hits,
+                    'misses': self.misses,
+                    'refreshes': self.refreshes,
+                    'errors': self.errors,
+                    'entries': {' '.join(str(part) for part in key): {'age': round(now - entry.rendered_at, 1),
+                                                                       'expires_in': round(entry.expires_at - now, 1)}
+                                for key, entry in self.entries.items()}}
@@ -0,0 +1,245 @@
+"""
+Water levels of a station for charting in the browser, as compact JSON or packed binary,
+its high and low waters and the plot images
+"""
+
+import json
+import struct
+import hashlib
+import numpy as np
+from tides import STATIONS, TIDE_INFO_WEBPAGE_TEMPLATE, tide_series_from_web, process
+from tides_events import detect_events
+from tides_metrics import METRICS
+from tides_rollup import RollupStore, history
+
+
+BINARY_MAGIC = b'TIDE'
+# Magic, number of readings n - then uint32 times[n], float32 levels[n], float32 speed[n - 1]
+BINARY_HEADER = struct.Struct('<4sI')
+
+JSON_TYPE = 'application/json'
+BINARY_TYPE = 'application/octet-stream'
+PNG_TYPE = 'image/png'
+
+
+class SeriesPayload:
+    """ Both encodings of a series, and the ETag they share """
+
+    def __init__(self, station, series):
+
+        self.station = station
+        self.count = len(series)
+        # UTC epoch seconds of the latest reading
+        self.observed = int(series.times[-1])
+
+        self.binary = encode_binary(series)
+        self.json = encode_json(station, series)
+        self.etag = hashlib.sha1(self.binary).hexdigest()
+
+    def body(self, binary=False):
+        """ (content, content type, ETag) """
+
+        if binary:
+            return self.binary, BINARY_TYPE, f'"{self.etag}-bin"'
+        return self.json, JSON_TYPE, f'"{self.etag}-json"'
+
+
+class EventsPayload:
+    """ High and low waters of a station as JSON, and its ETag """
+
+    def __init__(self, station, events, observed):
+
+        self.station = station
+        self.count = len(events)
+        self.observed = observed
+
+        self.json = json.dumps({'station': station,
+                                'events': [event.to_dict() for event in events]},
+                               separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(self.json).hexdigest()
+
+    def body(self, binary=False):
+
+        return self.json, JSON_TYPE, f'"{self.etag}"'
+
+
+class RollupsPayload:
+    """ Hourly or daily rollups of a station as JSON columns, and its ETag """
+
+    def __init__(self, station, period, buckets, observed):
+
+        self.station = station
+        self.count = len(buckets)
+        self.observed = observed
+
+        content = {'station': station,
+                   'period': period,
+                   'start': buckets['time'].tolist(),
+                   'count': buckets['count'].tolist(),
+                   'min': np.round(buckets['min'].astype(np.float64), 3).tolist(),
+                   'min_time': buckets['min_time'].tolist(),
+                   'max': np.round(buckets['max'].astype(np.float64), 3).tolist(),
+                   'max_time': buckets['max_time'].tolist(),
+                   'mean': np.round(buckets['sum'] / buckets['count'], 3).tolist(),
+                   # null without a previous reading
+                   'max_rise': [None if np.isnan(speed) else round(speed, 2)
+                                for speed in buckets['max_rise'].astype(np.float64).tolist()],
+                   'max_fall': [None if np.isnan(speed) else round(speed, 2)
+                                for speed in buckets['max_fall'].astype(np.float64).tolist()]}
+
+        self.json = json.dumps(content, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(self.json).hexdigest()
+
+    def body(self, binary=False):
+
+        return self.json, JSON_TYPE, f'"{self.etag}"'
+
+
+class PlotPayload:
+    """ The plot as PNG bytes, served as they are """
+
+    def __init__(self, station, png, observed):
+
+        self.station = station
+        self.png = png
+        self.observed = observed
+        self.etag = hashlib.sha1(png).hexdigest()
+
+    def body(self, binary=True):
+
+        return self.png, PNG_TYPE, f'"{self.etag}"'
+
+
+def encode_json(station, series):
+    """
+    {"station", "description", "start" (UTC epoch seconds), "steps" (minutes between readings),
+     "levels" (m), "speed" (cm/min)} without whitespace - the steps are nearly all 15
+    """
+
+    content = {'station': station,
+               'description': STATIONS[station][1],
+               'start': int(series.times[0]) if len(series) else None,
+               'steps': (np.diff(series.times) // 60).tolist(),
+               'levels': np.round(series.levels.astype(np.float64), 3).tolist(),
+               # null where unknown, e.g. into the first reading of the rollups
+               'speed': [None if np.isnan(speed) else speed
+                         for speed in np.round(series.speed.astype(np.float64), 2).tolist()]}
+
+    return json.dumps(content, separators=(',', ':')).encode('utf-8')
+
+
+def encode_binary(series):
+    """ Little endian, 4 byte aligned so each array maps straight onto a JavaScript typed array """
+
+    return b''.join((BINARY_HEADER.pack(BINARY_MAGIC, len(series)),
+                     series.times.astype('<u4').tobytes(),
+                     series.levels.astype('<f4').tobytes(),
+                     series.speed.astype('<f4').tobytes()))
+
+
+def download_series(station):
+
+    tide_info_page = TIDE_INFO_WEBPAGE_TEMPLATE.format(station=STATIONS[station][0])
+
+    return tide_series_from_web(tide_info_page, station)
+
+
+def load_series(station, all_five_days):
+    """ Payload of the latest readings of the station, None when there are none """
+
+    series = download_series(station)
+
+    if not all_five_days:
+        # Only the last 2 days, as on the plot
+        series = series[4 * 24 * 4:]
+
+    if len(series) == 0:
+        return None
+
+    with METRICS.timed('encode'):
+        payload = SeriesPayload(station, series)
+    METRICS.add_bytes('encode', len(payload.binary) + len(payload.json))
+
+    return payload
+
+
+def load_events(station):
+    """ Payload of the high and low waters over the five days on the station page, None without readings """
+
+    series = download_series(station)
+
+    if len(series) == 0:
+        return None
+
+    return EventsPayload(station, detect_events(series), int(series.times[-1]))
+
+
+def load_history(station, start=None, end=None, rollups=None):
+    """
+    Payload of the recorded readings in [start, end) (UTC epoch seconds), None when there are
+    none - over long ranges the min and max of each hour or day, from the rollups
+    """
+
+    # Binary searches in the memory mapped records: as long to answer, whatever the size of the history
+    series = history(station, start, end, rollups)
+
+    if len(series) == 0:
+        return None
+
+    return SeriesPayload(station, series)
+
+
+def load_rollups(station, period, start=None, end=None, rollups=None):
+    """ Payload of the hourly or daily buckets starting in [start, end), None when there are none """
+
+    buckets = (rollups or RollupStore()).query(station, period, start, end)
+
+    if len(buckets) == 0:
+        return None
+
+    return RollupsPayload(station, period, buckets, int(max(buckets['min_time'][-1], buckets['max_time'][-1])))
+
+
+def load_tide_table(station, start=None, end=None, rollups=None):
+    """ Payload of the recorded high and low waters in [start, end), None when there are none """
+
+    events = (rollups or RollupStore()).tide_table(station, start, end)
+
+    if not events:
+        return None
+
+    return EventsPayload(station, events, events[-1].detected)
+
+
+def load_plot(station, all_five_days, pool=None):
+    """
+    Payload of the plot of the latest readings of the station, None when there are none - rendered
+    by the pool of render workers when there's one
+    """
+
+    series = download_series(station)
+
+    if pool is None:
+        png = process(series, station, show_plot=False, all_five_days=all_five_days, return_png=True)
+    else:
+        if not all_five_days:
+            series = series[4 * 24 * 4:]
+        png = pool.render(station, series) if len(series) else None
+
+    if png is None:
+        return None
+
+    return PlotPayload(station, png, int(series.times[-1]))
+
+
+def load_dashboard(all_five_days, pool=None):
+    """ Payload of the plot of all the stations, None when none has readings """
+
+    # Without a pool, get_pool() starts one on first use - the app passes one started before its threads
+    from tides_dashboard import dashboard_from_web
+
+    stations_series, png = dashboard_from_web(all_five_days, pool)
+    if png is None:
+        return None
+
+    return PlotPayload('dashboard', png, max(int(series.times[-1]) for _, series in stations_series if len(series)))
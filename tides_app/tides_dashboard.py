@@ -0,0 +1,277 @@
+"""
+All the stations on one image: the water level along the river, every station on one plot,
+above a small panel per station on the same time axis and level scale.
+
+The panels are rendered as pixels by a pool of processes, each keeping its figure between
+renders, while the overlay is rendered here - then they are pasted together and encoded once.
+"""
+
+import io
+import os
+import threading
+import concurrent.futures
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from tides_render import WATER_COLOR, TITLE_COLOR, DATE_FORMAT
+from tides_metrics import METRICS
+
+
+PANEL_SIZE = (6.4, 3.2)  # inches
+COLUMNS = 3  # Panels per row, the overlay is as wide as a row
+OVERLAY_ROWS = 2  # Height of the overlay, in panels
+DPI = 100
+POOL_PROCESSES = min(9, os.cpu_count() or 1)  # One per station at most
+
+# Same axes position in every panel so their time axes line up once pasted
+PANEL_MARGINS = {'left': 0.09, 'right': 0.98, 'bottom': 0.2, 'top': 0.86}
+OVERLAY_MARGINS = {'left': 0.04, 'right': 0.86, 'bottom': 0.12, 'top': 0.92}
+
+# Downstream to upstream
+RIVER_COLORMAP = 'viridis'
+
+
+def make_figure(size, margins):
+
+    figure = Figure(figsize=size, dpi=DPI)
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(**margins)
+
+    return figure
+
+
+def pixels(figure):
+    """ RGBA pixels of the figure, (height, width, 4) uint8 """
+
+    figure.canvas.draw()
+
+    return np.array(figure.canvas.buffer_rgba())
+
+
+def date_numbers(times):
+
+    from tides import london_datetime64
+
+    return mdates.date2num(london_datetime64(times).astype('datetime64[s]'))
+
+
+class PanelRenderer:
+    """ Water level of a station on a small figure, redrawn with each station's data """
+
+    def __init__(self):
+
+        self.figure = make_figure(PANEL_SIZE, PANEL_MARGINS)
+
+        plot = self.figure.add_subplot(111)
+        plot.xaxis_date()
+        plot.xaxis.set_major_formatter(mdates.DateFormatter('%d %H:%M'))
+        plot.grid(color='g', linestyle=':', linewidth=0.5)
+        plot.tick_params(labelsize=8)
+
+        self.levels_line, = plot.plot([], [], WATER_COLOR, linewidth=1.5)
+        self.last_level, = plot.plot([], [], 'o', markersize=6, color=WATER_COLOR)
+        self.title = plot.set_title('', color=TITLE_COLOR, fontsize=11, fontweight='bold')
+
+        self.plot = plot
+
+    def render(self, title, x, levels, x_limits, level_limits):
+
+        self.levels_line.set_data(x, levels)
+        self.last_level.set_data(x[-1:], levels[-1:])
+        self.title.set_text(title)
+
+        self.plot.set_xlim(*x_limits)
+        self.plot.set_ylim(*level_limits)
+
+        return pixels(self.figure)
+
+
+# The renderer of a pool process, made on its first panel
+PANEL_RENDERER = None
+
+
+def render_panel(title, x, levels, x_limits, level_limits):
+    """ Pixels of a panel - runs in the pool processes """
+
+    global PANEL_RENDERER
+
+    if PANEL_RENDERER is None:
+        PANEL_RENDERER = PanelRenderer()
+
+    return PANEL_RENDERER.render(title, x, levels, x_limits, level_limits)
+
+
+def render_overlay(panels, x_limits, level_limits):
+    """ Pixels of the levels of all the stations on one plot """
+
+    import matplotlib.cm
+
+    rows = OVERLAY_ROWS * PANEL_SIZE[1]
+    figure = make_figure((COLUMNS * PANEL_SIZE[0], rows), OVERLAY_MARGINS)
+
+    plot = figure.add_subplot(111)
+    plot.xaxis_date()
+    plot.xaxis.set_major_formatter(mdates.DateFormatter(DATE_FORMAT))
+    plot.grid(color='g', linestyle=':', linewidth=0.5)
+
+    colors = getattr(matplotlib.cm, RIVER_COLORMAP)(np.linspace(0, 0.9, len(panels)))
+    for (station, x, levels), color in zip(panels, colors):
+        plot.plot(x, levels, color=color, linewidth=1.5, label=station)
+
+    plot.set_xlim(*x_limits)
+    plot.set_ylim(*level_limits)
+    plot.set_ylabel('Water level (m)', color=WATER_COLOR, fontweight='bold', fontsize=12)
+    plot.set_title('Water level along the Thames, from the sea up', color=TITLE_COLOR, fontsize=16,
+                   fontweight='bold')
+    plot.legend(loc='center left', bbox_to_anchor=(1.01, 0.5), fontsize='large')
+
+    return pixels(figure)
+
+
+def composite(overlay, panels, columns=COLUMNS):
+    """ The overlay above the panels, columns panels a row - all RGBA pixels """
+
+    height, width = panels[0].shape[:2]
+    blank = np.full_like(panels[0], 255)
+
+    panels = list(panels) + [blank] * (-len(panels) % columns)
+    rows = [np.concatenate(panels[k:k + columns], axis=1) for k in range(0, len(panels), columns)]
+
+    return np.concatenate([overlay[:, :columns * width]] + rows, axis=0)
+
+
+def encode_png(rgba):
+
+    import matplotlib.image
+
+    image_bytes = io.BytesIO()
+    matplotlib.image.imsave(image_bytes, rgba, format='png')
+
+    return image_bytes.getvalue()
+
+
+POOL = None
+POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """ The pool of panel renderers, started on first use and kept for the next dashboards """
+
+    global POOL
+
+    with POOL_LOCK:
+        if POOL is None:
+            POOL = concurrent.futures.ProcessPoolExecutor(max_workers=POOL_PROCESSES)
+
+    return POOL
+
+
+def start_pool():
+    """
+    The pool of panel renderers with all its processes started - they are forked, so call it
+    before starting threads, as RenderPool.start()
+    """
+
+    pool = get_pool()
+
+    # A process is started for each task submitted while none is idle
+    for future in [pool.submit(os.getpid) for _ in range(POOL_PROCESSES)]:
+        future.result()
+
+    return pool
+
+
+def render_dashboard(stations_series, pool=None):
+    """
+    PNG bytes of the dashboard of the (station, series) - in the order along the river, the
+    stations without readings left out - None when none has readings. The panels are rendered
+    by the pool, an executor or a RenderPool, else by the one of get_pool().
+    """
+
+    from tides import STATIONS
+
+    stations_series = [(station, series) for station, series in stations_series if len(series)]
+    if not stations_series:
+        return None
+
+    panels = [(station, date_numbers(series.times), series.levels) for station, series in stations_series]
+
+    # A little room after the latest reading for its marker
+    first, last = min(x[0] for _, x, _ in panels), max(x[-1] for _, x, _ in panels)
+    x_limits = (first, last + 0.01 * (last - first))
+    low = min(float(levels.min()) for _, _, levels in panels)
+    high = max(float(levels.max()) for _, _, levels in panels)
+    margin = 0.05 * (high - low) or 0.5
+    level_limits = (low - margin, high + margin)
+
+    pool = pool or get_pool()
+
+    # The panels, the overlay and pasting them together
+    with METRICS.timed('render'):
+        futures = [pool.submit(render_panel, f'{STATIONS[station][1]}  {levels[-1]:.1f}m', x, levels,
+                               x_limits, level_limits)
+                   for station, x, levels in panels]
+
+        # While the pool renders the panels
+        overlay = render_overlay(panels, x_limits, level_limits)
+
+        rgba = composite(overlay, [future.result() for future in futures])
+
+    with METRICS.timed('encode'):
+        png = encode_png(rgba)
+    METRICS.add_bytes('encode', len(png))
+
+    return png
+
+
+def dashboard_from_web(all_five_days=False, pool=None):
+    """ ((station, series) of all the stations, PNG bytes of their dashboard) - the pages downloaded at once """
+
+    from tides import STATIONS, tide_series_from_web_concurrently
+
+    arrived = dict(tide_series_from_web_concurrently(STATIONS))
+
+    stations_series = []
+    for station in STATIONS:
+        series = arrived[station]
+        if not all_five_days:
+            # The same days as the station plots
+            series = series[4 * 24 * 4:]
+        stations_series.append((station, series))
+
+    return stations_series, render_dashboard(stations_series, pool)
+
+
+def show_dashboard(all_five_days=False, show_plot=True, save_to_file=False):
+
+    from tides import RECORDS_DIR, london_time_from_epoch
+
+    stations_series, png = dashboard_from_web(all_five_days)
+
+    if png is None:
+        print('No data!')
+        return
+
+    if save_to_file:
+        last_date = london_time_from_epoch(max(series.times[-1] for _, series in stations_series if len(series)))
+        filename_date = str(last_date).replace(':', '-').replace(' ', '_')
+        pathname = f'{RECORDS_DIR}/Dashboard_{filename_date}_{5 if all_five_days else 2}_days.png'
+
+        try:
+            with open(pathname, 'wb') as f:
+                f.write(png)
+            print(f'Saved dashboard as {pathname}')
+        except FileNotFoundError:
+            print(f'Error: Couldn\'t save dashboard as {pathname}')
+
+    if show_plot:
+        import matplotlib.image
+        import matplotlib.pyplot as plt
+
+        rgba = matplotlib.image.imread(io.BytesIO(png))
+
+        figure = plt.figure(figsize=(rgba.shape[1] / DPI, rgba.shape[0] / DPI))
+        figure.figimage(rgba)
+        plt.show()
+        plt.close(figure)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""
+High and low water - slack water - found where the tide rise speed changes sign.
+
+The slack time is where the speed, interpolated between readings, is zero and the height is
+the level there on the parabola with that speed. A turn is only reported once the level has
+moved NOISE_LEVEL away from the reading at it, and MIN_SEPARATION after the previous one, so
+small wiggles of the level are not taken for tides.
+"""
+
+import sys
+import argparse
+import numpy as np
+
+
+NOISE_LEVEL = 0.05  # m - a reversal of the level by less than this is not a tide
+# s - a high and a low closer than this are noise around slack water, the tide rises in 3.5 hours
+# at Richmond, more downstream
+MIN_SEPARATION = 2 * 3600
+
+HIGH = 'high'
+LOW = 'low'
+
+
+class TideEvent:
+    """ High or low water at time (UTC epoch seconds), noticed at the reading at detected """
+
+    def __init__(self, kind, time, level, detected, station=''):
+
+        self.kind = kind
+        self.time = time
+        self.level = level
+        self.detected = detected
+        self.station = station
+
+    def __repr__(self):
+
+        return f'TideEvent({self.station!r}, {self.kind}, {self.time:.0f}, {self.level:.3f}m)'
+
+    def to_dict(self):
+
+        return {'kind': self.kind,
+                'time': int(round(self.time)),
+                'level': round(self.level, 3),
+                'detected': int(self.detected)}
+
+
+def turn(previous_midpoint, previous_slope, midpoint, slope, time, level):
+    """
+    (time, level) of the turn between two slopes (m/s) of opposite signs at the midpoints of
+    their readings - the speed is taken as linear between the midpoints, so the level is a
+    parabola through the reading (time, level) ending the first slope
+    """
+
+    curvature = (slope - previous_slope) / (midpoint - previous_midpoint)
+    slack_time = previous_midpoint + previous_slope / (previous_slope - slope) * (midpoint - previous_midpoint)
+
+    slack_level = (level + previous_slope * (slack_time - time)
+                   + curvature / 2 * ((slack_time - previous_midpoint) ** 2 - (time - previous_midpoint) ** 2))
+
+    return slack_time, slack_level
+
+
+class EventDetector:
+    """
+    Streaming detector - push the readings of a station as they arrive, O(1) each. Readings
+    not newer than the previous one (the station pages repeat some) are ignored.
+    """
+
+    def __init__(self, station='', noise_level=NOISE_LEVEL, min_separation=MIN_SEPARATION):
+
+        self.station = station
+        self.noise_level = noise_level
+        self.min_separation = min_separation
+
+        self.last_time = None
+        self.last_level = None
+        # Last non zero slope (m/s), the midpoint of its readings and the reading ending it -
+        # (slope, midpoint, time, level)
+        self.previous = None
+
+        self.looking_for = None
+        self.candidate = None
+        # Level of the reading at the candidate turn - the slack level may overshoot it
+        self.reference = None
+        # Slack time of the last event confirmed
+        self.last_event = None
+
+    def push(self, time, level):
+        """ The event confirmed by this reading, or None """
+
+        if self.last_time is not None and time <= self.last_time:
+            return None
+
+        if self.last_time is not None:
+            slope = (level - self.last_level) / (time - self.last_time)
+            midpoint = (self.last_time + time) / 2
+
+            if slope != 0:
+                previous = self.previous
+                if previous is not None and (slope > 0) != (previous[0] > 0):
+                    self.turned(previous, slope, midpoint, time)
+
+                self.previous = (slope, midpoint, time, level)
+
+        self.last_time = time
+        self.last_level = level
+
+        return self.confirm(time, level)
+
+    def turned(self, previous, slope, midpoint, time):
+        """ The level turned between the previous slope and this one, at the reading at time """
+
+        previous_slope, previous_midpoint, turn_time, turn_level = previous
+        kind = HIGH if previous_slope > 0 else LOW
+        slack_time, slack_level = turn(previous_midpoint, previous_slope, midpoint, slope, turn_time, turn_level)
+
+        if self.looking_for is None:
+            self.looking_for = kind
+
+        if kind != self.looking_for:
+            return
+
+        if self.last_event is not None and slack_time < self.last_event + self.min_separation:
+            return
+
+        if (self.candidate is None or (kind == HIGH and slack_level > self.candidate.level)
+                or (kind == LOW and slack_level < self.candidate.level)):
+            self.candidate = TideEvent(kind, slack_time, slack_level, time, self.station)
+            self.reference = turn_level
+
+    def confirm(self, time, level):
+
+        candidate = self.candidate
+        if candidate is None:
+            return None
+
+        if candidate.kind == HIGH and level <= self.reference - self.noise_level:
+            self.looking_for = LOW
+        elif candidate.kind == LOW and level >= self.reference + self.noise_level:
+            self.looking_for = HIGH
+        else:
+            return None
+
+        self.candidate = None
+        self.last_event = candidate.time
+        candidate.detected = time
+
+        return candidate
+
+    def extend(self, series):
+        """ Events confirmed by the readings of the series newer than the last pushed """
+
+        start = np.searchsorted(series.times, self.last_time, side='right') if self.last_time is not None else 0
+
+        events = []
+        for time, level in zip(series.times[start:].tolist(), series.levels[start:].astype(np.float64).tolist()):
+            event = self.push(time, level)
+            if event is not None:
+                events.append(event)
+
+        return events
+
+
+def detect_events(series, noise_level=NOISE_LEVEL, min_separation=MIN_SEPARATION, after=None):
+    """
+    Events of a whole series, e.g. the stored history of a station - the turns are found in
+    one pass over the arrays, only their confirmation goes turn by turn. The same events as
+    pushing the readings one by one to an EventDetector.
+
+    after is the last event already found, the detection goes on from its confirmation - the
+    series needs the readings before it for the slopes of the next turns.
+    """
+
+    # The first of repeated readings, as the detector
+    times, index = np.unique(series.times, return_index=True)
+    times = times.astype(np.float64)
+    levels = series.levels[index].astype(np.float64)
+
+    slopes = np.diff(levels) / np.diff(times)
+    midpoints = (times[:-1] + times[1:]) / 2
+
+    # Sign changes of the non zero slopes - a flat stretch belongs to the turn
+    nonzero = np.flatnonzero(slopes)
+    turns = np.flatnonzero((slopes[nonzero[:-1]] > 0) != (slopes[nonzero[1:]] > 0))
+    previous, current = nonzero[turns], nonzero[turns + 1]
+
+    slack_times, slack_levels = turn(midpoints[previous], slopes[previous], midpoints[current], slopes[current],
+                                     times[previous + 1], levels[previous + 1])
+    kinds = np.where(slopes[previous] > 0, HIGH, LOW)
+    # Readings at the turns, and where they are seen
+    turn_levels = levels[previous + 1]
+    seen = current + 1
+
+    events = []
+    looking_for = None
+    candidate = None
+    reference = None
+    last_event = None
+    checked = 0
+
+    if after is not None:
+        looking_for = LOW if after.kind == HIGH else HIGH
+        last_event = after.time
+        later = times[seen] > after.detected
+        turns, slack_times, slack_levels, kinds, turn_levels, seen = (
+            turns[later], slack_times[later], slack_levels[later], kinds[later], turn_levels[later], seen[later])
+
+    def confirm(candidate, reference, end):
+        """ First reading in [checked, end) moving the level noise_level away from the candidate turn """
+
+        window = levels[checked:end]
+        if candidate.kind == HIGH:
+            moved = np.flatnonzero(window <= reference - noise_level)
+        else:
+            moved = np.flatnonzero(window >= reference + noise_level)
+
+        return checked + moved[0] if len(moved) else None
+
+    for k in range(len(turns) + 1):
+        end = seen[k] if k < len(turns) else len(times)
+
+        if candidate is not None:
+            confirmed = confirm(candidate, reference, end)
+            if confirmed is not None:
+                candidate.detected = int(times[confirmed])
+                events.append(candidate)
+                looking_for = LOW if candidate.kind == HIGH else HIGH
+                last_event = candidate.time
+                candidate = None
+
+        if k == len(turns):
+            break
+
+        kind, slack_level = kinds[k], float(slack_levels[k])
+
+        if looking_for is None:
+            looking_for = kind
+
+        # Turns too close to the last event are noise around slack water
+        separated = last_event is None or slack_times[k] >= last_event + min_separation
+
+        if kind == looking_for and separated and (candidate is None or (kind == HIGH and slack_level > candidate.level)
+                                                   or (kind == LOW and slack_level < candidate.level)):
+            candidate = TideEvent(str(kind), float(slack_times[k]), slack_level, int(times[end]), series.station)
+            reference = turn_levels[k]
+
+        checked = end
+
+    return events
+
+
+def print_events(events):
+
+    from tides import london_time_from_epoch
+
+    for event in events:
+        print(f'{event.station} {event.kind:>4} water {london_time_from_epoch(event.time):%Y-%m-%d %H:%M %Z}'
+              f' {event.level:5.2f}m   (seen {london_time_from_epoch(event.detected):%H:%M})')
+
+
+def main():
+
+    from tides import STATIONS, tide_series_from_web_concurrently
+    from tides_store import TideStore
+
+    parser = argparse.ArgumentParser(description='High and low water times of the stations')
+    parser.add_argument('--station', help='station to show', default='Chelsea')
+    parser.add_argument('--all', help='all stations', action='store_true')
+    parser.add_argument('--store', help='from all the history recorded by record_tide.py', action='store_true')
+    args = parser.parse_args()
+
+    stations = list(STATIONS) if args.all else [args.station]
+    if any(station not in STATIONS for station in stations):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    if args.store:
+        store = TideStore()
+        series = [(station, store.query(station)) for station in stations]
+    else:
+        series = tide_series_from_web_concurrently(stations)
+
+    for station, station_series in series:
+        print_events(detect_events(station_series))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,159 @@
+"""
+Downloads of the station pages - several at once, over kept alive connections,
+conditional on the page having changed since the last download
+"""
+
+import hashlib
+import functools
+import threading
+import concurrent.futures
+from tides_metrics import METRICS
+
+
+MAX_WORKERS = 9  # One per station
+TIMEOUT = (5, 30)  # Seconds to connect and to wait for the page
+
+
+def make_session(pool_size=MAX_WORKERS):
+
+    # requests is imported on the first download, not at start up
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+
+    # All the pages come from the same host, keep a connection per worker
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """ The shared session, created on first use """
+
+    global SESSION
+
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = make_session()
+
+    return SESSION
+
+
+class CachedPage:
+    """ Validators and body hash of the last download of a page, with what was parsed from it """
+
+    def __init__(self, etag, last_modified, digest, value):
+
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.value = value
+
+
+# url -> CachedPage
+PAGE_CACHE: dict = {}
+PAGE_CACHE_LOCK = threading.Lock()
+
+
+def fetch_page(url: str, session=None, timeout=TIMEOUT):
+    """ Text of the page or None when it couldn't be downloaded """
+
+    import requests
+
+    session = session or get_session()
+
+    try:
+        with METRICS.timed('fetch'):
+            page = session.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        print(f'Couldn\'t open the web page {url}: {e}')
+        return None
+
+    METRICS.add_bytes('fetch', len(page.content))
+
+    if page.status_code != requests.codes.ok:
+        METRICS.error('fetch')
+        print(f'Couldn\'t open the web page {url}')
+        return None
+
+    return page.text
+
+
+def fetch_parsed(url: str, parse, session=None, timeout=TIMEOUT):
+    """
+    parse(text) of the page or None when it couldn't be downloaded.
+
+    The page is only parsed when it has changed: the request is conditional on the
+    ETag / Last-Modified of the previous download and on a 304, or the same body
+    as last time, the previous result of parse is returned.
+    """
+
+    import requests
+
+    session = session or get_session()
+
+    with PAGE_CACHE_LOCK:
+        cached = PAGE_CACHE.get(url)
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+
+    try:
+        with METRICS.timed('fetch'):
+            page = session.get(url, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        print(f'Couldn\'t open the web page {url}: {e}')
+        return None
+
+    METRICS.add_bytes('fetch', len(page.content))
+
+    if page.status_code == requests.codes.not_modified and cached is not None:
+        return cached.value
+
+    if page.status_code != requests.codes.ok:
+        METRICS.error('fetch')
+        print(f'Couldn\'t open the web page {url}')
+        return None
+
+    digest = hashlib.sha1(page.content).digest()
+
+    if cached is not None and cached.digest == digest:
+        value = cached.value
+    else:
+        value = parse(page.text)
+
+    with PAGE_CACHE_LOCK:
+        PAGE_CACHE[url] = CachedPage(page.headers.get('ETag'), page.headers.get('Last-Modified'), digest, value)
+
+    return value
+
+
+def fetch_pages(urls: dict, max_workers=MAX_WORKERS, session=None, timeout=TIMEOUT, parse=None):
+    """
+    (key, text) for the {key: url} pages in the order they arrive - text is None on errors.
+    With parse, (key, parse(key, text)) through fetch_parsed - only parsing changed pages.
+    """
+
+    session = session or get_session()
+
+    def fetch(key, url):
+        if parse is None:
+            return fetch_page(url, session, timeout)
+        return fetch_parsed(url, functools.partial(parse, key), session, timeout)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(urls) or 1)) as executor:
+        futures = {executor.submit(fetch, key, url): key for key, url in urls.items()}
+
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""
+Tide prediction from the harmonic constituents of a station, fitted on the recorded history.
+
+The level is modelled as a mean plus a sum of cosines at the speeds of the tidal constituents.
+Their amplitudes and phases come from a least squares fit on the readings in the store and are
+kept as JSON, so a forecast for any time range needs no web access. No nodal corrections:
+refit every few months rather than predict years ahead.
+"""
+
+import os
+import sys
+import json
+import datetime
+import argparse
+import numpy as np
+from tides_series import TideSeries, READING_MINUTES
+
+
+MODEL_DIR = 'models'  # Relative to the current directory
+FORECAST_HOURS = 12  # Drawn after the last reading on the plot
+
+# Speeds in degrees per hour, in the order they are taken when the record is too short
+# to separate them all (Rayleigh criterion) - M4, MS4, M6... are the shallow water ones,
+# large on the Thames
+CONSTITUENTS = {'M2': 28.9841042,
+                'S2': 30.0000000,
+                'K1': 15.0410686,
+                'O1': 13.9430356,
+                'N2': 28.4397295,
+                'M4': 57.9682084,
+                'MS4': 58.9841042,
+                'M6': 86.9523127,
+                'MN4': 57.4238337,
+                'K2': 30.0821373,
+                'P1': 14.9589314,
+                'Q1': 13.3986609,
+                '2N2': 27.8953548,
+                'M8': 115.9364166,
+                'MF': 1.0980331,
+                'MM': 0.5443747}
+
+# Phases are relative to this time, UTC epoch seconds
+REFERENCE_EPOCH = int(datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def hours_since_reference(times):
+
+    return (np.asarray(times, dtype=np.float64) - REFERENCE_EPOCH) / 3600
+
+
+def resolvable_constituents(duration_hours, names=CONSTITUENTS):
+    """ Constituents the record can tell apart: a cycle apart over the record from those already taken """
+
+    taken: list = []
+
+    for name in names:
+        frequency = CONSTITUENTS[name] / 360
+        if frequency * duration_hours < 1:
+            # Not even a cycle in the record
+            continue
+        if all(abs(frequency - CONSTITUENTS[other] / 360) * duration_hours >= 1 for other in taken):
+            taken.append(name)
+
+    return taken
+
+
+class TidalModel:
+    """ Mean level plus the constituents, amplitude (m) and phase (degrees) of each """
+
+    def __init__(self, station, mean, constituents, amplitudes, phases, start=None, end=None, count=0, rms=None):
+
+        self.station = station
+        self.mean = float(mean)
+        self.constituents = list(constituents)
+        self.amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        self.phases = np.asarray(phases, dtype=np.float64)
+        # Readings fitted on, and how far off the model was on them (m)
+        self.start = start
+        self.end = end
+        self.count = count
+        self.rms = rms
+
+        self.speeds = np.radians([CONSTITUENTS[name] for name in self.constituents])
+
+    def __repr__(self):
+
+        return f'TidalModel({self.station!r}, {len(self.constituents)} constituents, rms={self.rms})'
+
+    def predict(self, times):
+        """ Levels at the times (UTC epoch seconds) - one array operation for any number of times """
+
+        angles = np.multiply.outer(hours_since_reference(times), self.speeds) - np.radians(self.phases)
+
+        return self.mean + np.cos(angles) @ self.amplitudes
+
+    def forecast(self, start, end, step_minutes=READING_MINUTES):
+        """ Series of the predicted levels every step_minutes in [start, end) - UTC epoch seconds """
+
+        times = np.arange(start, end, step_minutes * 60, dtype=np.int64)
+
+        return TideSeries(times, self.predict(times), self.station)
+
+    def to_dict(self):
+
+        return {'station': self.station,
+                'mean': self.mean,
+                'constituents': self.constituents,
+                'amplitudes': self.amplitudes.tolist(),
+                'phases': self.phases.tolist(),
+                'start': self.start,
+                'end': self.end,
+                'count': self.count,
+                'rms': self.rms}
+
+    @classmethod
+    def from_dict(cls, content):
+
+        return cls(**content)
+
+
+def fit(series, constituents=None):
+    """
+    Model fitted on the series, None when it is too short. One least squares solve of the
+    levels on a cosine and a sine column per constituent.
+    """
+
+    times, index = np.unique(series.times, return_index=True)
+    levels = series.levels[index].astype(np.float64)
+
+    valid = np.isfinite(levels)
+    times, levels = times[valid], levels[valid]
+
+    if len(times) < 2:
+        return None
+
+    if constituents is None:
+        constituents = resolvable_constituents((times[-1] - times[0]) / 3600)
+
+    if not constituents or len(times) <= 2 * len(constituents) + 1:
+        return None
+
+    speeds = np.radians([CONSTITUENTS[name] for name in constituents])
+    angles = np.multiply.outer(hours_since_reference(times), speeds)
+
+    design = np.hstack((np.ones((len(times), 1)), np.cos(angles), np.sin(angles)))
+    coefficients, _, _, _ = np.linalg.lstsq(design, levels, rcond=None)
+
+    count = len(constituents)
+    cosines, sines = coefficients[1:count + 1], coefficients[count + 1:]
+    rms = float(np.sqrt(np.mean((design @ coefficients - levels) ** 2)))
+
+    # a cos(wt) + b sin(wt) = A cos(wt - phase)
+    return TidalModel(series.station, coefficients[0], constituents,
+                      np.hypot(cosines, sines), np.degrees(np.arctan2(sines, cosines)) % 360,
+                      int(times[0]), int(times[-1]), len(times), rms)
+
+
+def model_path(station, directory=MODEL_DIR):
+
+    return os.path.join(directory, f'{station.replace(" ", "_")}.json')
+
+
+def save_model(model, directory=MODEL_DIR):
+
+    os.makedirs(directory, exist_ok=True)
+
+    with open(model_path(model.station, directory), 'w') as f:
+        json.dump(model.to_dict(), f, indent=1)
+
+
+# path -> (modification time, model)
+MODELS: dict = {}
+
+
+def load_model(station, directory=MODEL_DIR):
+    """ The saved model of the station, None when it hasn't been fitted - read again only when the file changes """
+
+    path = model_path(station, directory)
+
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = MODELS.get(path)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+
+    try:
+        with open(path) as f:
+            model = TidalModel.from_dict(json.load(f))
+    except (OSError, ValueError, TypeError) as e:
+        print(f'Couldn\'t load the tide model {path}: {e}')
+        return None
+
+    MODELS[path] = (modified, model)
+
+    return model
+
+
+def fit_station(station, store=None, directory=MODEL_DIR):
+    """ Fit the station on all its readings in the store and save the model """
+
+    from tides_store import TideStore
+
+    series = (store or TideStore()).query(station)
+    model = fit(series)
+
+    if model is None:
+        print(f'Not enough readings of {station} to fit a model: {len(series)}')
+        return None
+
+    save_model(model, directory)
+
+    return model
+
+
+def main():
+
+    from tides import STATIONS, london_time_from_epoch, epoch_from_date
+    from tides_events import detect_events, print_events
+
+    parser = argparse.ArgumentParser(description='Tide predictions from the recorded history')
+    parser.add_argument('--station', help='station', default='Chelsea')
+    parser.add_argument('--all', help='all stations', action='store_true')
+    parser.add_argument('--fit', help='fit on the readings recorded by record_tide.py', action='store_true')
+    parser.add_argument('--from', dest='start', help='predict from this date (YYYY-MM-DD[THH:MM], UTC), default now')
+    parser.add_argument('--days', help='days to predict', type=float, default=1)
+    args = parser.parse_args()
+
+    stations = list(STATIONS) if args.all else [args.station]
+    if any(station not in STATIONS for station in stations):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    try:
+        start = epoch_from_date(args.start)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if start is None:
+        start = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    end = start + int(args.days * 24 * 3600)
+
+    for station in stations:
+        model = fit_station(station) if args.fit else load_model(station)
+
+        if model is None:
+            print(f'No model of {station}, fit one with --fit')
+            continue
+
+        print(f'\n=== {station}: {len(model.constituents)} constituents fitted on {model.count} readings'
+              f' from {london_time_from_epoch(model.start)} to {london_time_from_epoch(model.end)},'
+              f' rms {model.rms:.3f}m\n')
+
+        print_events(detect_events(model.forecast(start, end)))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+"""
+Hourly and daily rollups of the recorded water levels, and the tide table, kept up to date
+as record_tide.py stores new readings.
+
+A bucket keeps the count, the min and max levels and their times, the sum of the levels and
+the largest rise and fall speeds, in fixed width records next to the store's. Appending
+readings only recomputes the last bucket and the new ones, so a year shown by day reads
+365 records instead of 35,000 readings. Days are London days.
+"""
+
+import os
+import sys
+import fcntl
+import bisect
+import argparse
+import contextlib
+import numpy as np
+from tides_series import TideSeries, READING_MINUTES
+from tides_store import TideStore, read_records, write_records
+from tides_events import TideEvent, HIGH, LOW, detect_events
+
+
+HOUR = 3600  # s
+DAY = 24 * HOUR
+
+ROLLUP = np.dtype([('time', '<i8'),  # Start of the bucket, UTC epoch seconds
+                   ('count', '<i4'),
+                   ('min', '<f4'), ('min_time', '<i8'),
+                   ('max', '<f4'), ('max_time', '<i8'),
+                   ('sum', '<f8'),  # Of the levels - the mean of any number of buckets is exact
+                   ('max_rise', '<f4'), ('max_fall', '<f4')])  # cm/min, NaN without any previous reading
+
+# High or low water, as a TideEvent
+EVENT = np.dtype([('time', '<f8'), ('level', '<f4'), ('detected', '<i8'), ('high', 'u1')])
+
+EVENT_CONTEXT = DAY  # Readings before the last stored high or low water, for the slopes of the next turns
+
+# Longer ranges are shown from the hourly rollups, then from the daily ones
+HOURLY_FROM_DAYS = 14
+DAILY_FROM_DAYS = 92
+
+SPEED_FACTOR = np.float32(100 / READING_MINUTES)  # Level difference (m) between readings to cm/min
+
+
+def hour_starts(times):
+
+    return times // HOUR * HOUR
+
+
+def london_day_starts(times):
+    """ UTC epoch seconds of the London midnight before each of the times """
+
+    from tides import london_offsets
+
+    # The clocks change at 01:00 UTC, so midnight has the offset of 00:00 UTC that day
+    days = (times + london_offsets(times)) // DAY * DAY
+
+    return days - london_offsets(days)
+
+
+# Files, by their extension, and the bucket of each reading
+PERIODS = {'hourly': hour_starts,
+           'daily': london_day_starts}
+
+
+def rollup(times, levels, speeds, starts):
+    """
+    Records of the buckets of the readings - starts is the bucket of each, in time order, and
+    speeds the rise speed into each reading. One pass of array operations.
+    """
+
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(starts)) + 1))
+
+    # The first of each bucket once sorted by level in it - the earliest of equal levels
+    lowest = np.lexsort((levels, starts))[bounds]
+    highest = np.lexsort((-levels, starts))[bounds]
+
+    records = np.empty(len(bounds), dtype=ROLLUP)
+    records['time'] = starts[bounds]
+    records['count'] = np.diff(np.append(bounds, len(times)))
+    records['min'], records['min_time'] = levels[lowest], times[lowest]
+    records['max'], records['max_time'] = levels[highest], times[highest]
+    records['sum'] = np.add.reduceat(levels.astype(np.float64), bounds)
+    # NaN only when all are
+    records['max_rise'] = np.fmax.reduceat(speeds, bounds)
+    records['max_fall'] = np.fmin.reduceat(speeds, bounds)
+
+    return records
+
+
+def rollup_series(series, period='daily'):
+    """ Records of the buckets of a whole series """
+
+    speeds = np.empty(len(series), dtype=np.float32)
+    speeds[:1] = np.nan
+    speeds[1:] = series.speed
+
+    return rollup(series.times, series.levels, speeds, PERIODS[period](series.times))
+
+
+def slice_by_time(records, field, start, end):
+    """ Copy of the sorted records with field in [start, end) - None for unbounded """
+
+    times = records[field]
+
+    # Binary searches reading only the records they look at, as TideStore.query
+    first = 0 if start is None else bisect.bisect_left(times, start)
+    last = len(records) if end is None else bisect.bisect_left(times, end, lo=first)
+
+    return np.array(records[first:last])
+
+
+class RollupStore:
+    """ Rollups and tide table of the stations in a TideStore, kept in its directory """
+
+    def __init__(self, store=None):
+
+        self.store = store or TideStore()
+
+    def path(self, station, period):
+
+        return os.path.splitext(self.store.path(station))[0] + f'.{period}'
+
+    def records(self, station, period='daily'):
+        """ Read only memory map of the buckets of the period """
+
+        return read_records(self.path(station, period), ROLLUP)
+
+    def event_records(self, station):
+
+        return read_records(self.path(station, 'events'), EVENT)
+
+    @contextlib.contextmanager
+    def lock(self, station):
+        """ Held while the files of the station are written - record_tide.py and tides_rollup.py --rebuild can overlap """
+
+        path = self.path(station, 'lock')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def update(self, station):
+        """ Recompute the buckets from the last one on and extend the tide table - returns how many buckets """
+
+        with self.lock(station):
+            return self.recompute(station)
+
+    def recompute(self, station):
+        """ update() of a locked station """
+
+        readings = self.store.records(station)
+        if len(readings) == 0:
+            return 0
+
+        count = 0
+
+        for period, bucket_starts in PERIODS.items():
+            buckets = self.records(station, period)
+            # The last bucket may have got more readings
+            keep = max(len(buckets) - 1, 0)
+            first = bisect.bisect_left(readings['time'], buckets['time'][-1]) if len(buckets) else 0
+
+            # With the reading before, for the speed into the first one
+            previous = max(first - 1, 0)
+            selected = np.array(readings[previous:])
+            speeds = np.empty(len(selected), dtype=np.float32)
+            speeds[:1] = np.nan
+            speeds[1:] = np.diff(selected['level']) * SPEED_FACTOR
+
+            selected, speeds = selected[first - previous:], speeds[first - previous:]
+            records = rollup(selected['time'], selected['level'], speeds, bucket_starts(selected['time']))
+
+            write_records(self.path(station, period), records, keep)
+            count += len(records)
+
+        self.update_events(station, readings)
+
+        return count
+
+    def update_events(self, station, readings):
+        """ Add the high and low waters after the last stored - returns how many """
+
+        events = self.event_records(station)
+        last = None
+        if len(events):
+            time, level, detected, high = events[-1].tolist()
+            last = TideEvent(HIGH if high else LOW, time, level, detected, station)
+
+        # Going on from it, with the readings of a day before for the slopes of the next turns
+        first = 0 if last is None else bisect.bisect_left(readings['time'], int(last.time) - EVENT_CONTEXT)
+        selected = np.array(readings[first:])
+
+        found = detect_events(TideSeries(selected['time'], selected['level'], station), after=last)
+
+        if not found:
+            return 0
+
+        records = np.array([(event.time, event.level, event.detected, event.kind == HIGH) for event in found],
+                           dtype=EVENT)
+        write_records(self.path(station, 'events'), records)
+
+        return len(records)
+
+    def rebuild(self, station):
+        """ All the buckets and the tide table again, from all the readings """
+
+        with self.lock(station):
+            for period in list(PERIODS) + ['events']:
+                path = self.path(station, period)
+                if os.path.exists(path):
+                    os.remove(path)
+
+            return self.recompute(station)
+
+    def query(self, station, period='daily', start=None, end=None):
+        """ Records of the buckets starting in [start, end) - UTC epoch seconds, None for unbounded """
+
+        return slice_by_time(self.records(station, period), 'time', start, end)
+
+    def tide_table(self, station, start=None, end=None):
+        """ High and low waters in [start, end) """
+
+        return [TideEvent(HIGH if high else LOW, time, level, detected, station)
+                for time, level, detected, high in slice_by_time(self.event_records(station), 'time', start, end)
+                .tolist()]
+
+
+class RollupSeries:
+    """
+    Buckets shown as a series: the min and the max level of each, at their times, then the
+    latest reading - the peaks and troughs of the range, as on a downsampled plot. Its speed
+    is the largest fall into each min and rise into each max.
+
+    Has the statistics of a TideSeries, from all the readings of the buckets, so it can be
+    reported and plotted the same way.
+    """
+
+    def __init__(self, buckets, latest, station=''):
+        """ latest: the last two stored readings of the range, or fewer """
+
+        self.buckets = buckets
+        self.station = station
+
+        low_first = buckets['min_time'] <= buckets['max_time']
+
+        def in_order(low, high):
+            return np.column_stack((np.where(low_first, low, high), np.where(low_first, high, low))).ravel()
+
+        times = in_order(buckets['min_time'], buckets['max_time'])
+        levels = in_order(buckets['min'], buckets['max'])
+        speed = in_order(buckets['max_fall'], buckets['max_rise'])[1:]
+
+        if len(latest) and latest['time'][-1] > times[-1]:
+            times = np.append(times, latest['time'][-1])
+            levels = np.append(levels, latest['level'][-1])
+            speed = np.append(speed, np.diff(latest['level'])[-1:] * SPEED_FACTOR if len(latest) > 1 else np.nan)
+
+        self.times = times.astype(np.int64)
+        self.levels = levels.astype(np.float32)
+        self.speed = speed.astype(np.float32)
+
+        self.max_level = float(buckets['max'].max())
+        self.min_level = float(buckets['min'].min())
+        self.mean_level = float(buckets['sum'].sum() / buckets['count'].sum())
+        self.max_rise_speed = float(np.fmax.reduce(buckets['max_rise']))
+        self.max_fall_speed = float(np.fmin.reduce(buckets['max_fall']))
+
+    def __len__(self):
+
+        return len(self.times)
+
+    def __repr__(self):
+
+        return f'RollupSeries({self.station!r}, {len(self.buckets)} buckets)'
+
+    @property
+    def amplitude(self):
+
+        return self.max_level - self.min_level
+
+
+def history(station, start=None, end=None, rollups=None):
+    """
+    The recorded readings in [start, end) - a TideSeries, or a RollupSeries of the buckets
+    starting in the range when it is longer than HOURLY_FROM_DAYS. Only reads: without up to
+    date rollups, the readings themselves.
+    """
+
+    rollups = rollups or RollupStore()
+    store = rollups.store
+
+    readings = store.records(station)
+    if len(readings) == 0:
+        return store.query(station, start, end)
+
+    first = int(readings['time'][0]) if start is None else start
+    last = int(readings['time'][-1]) + 1 if end is None else end
+
+    if last - first <= HOURLY_FROM_DAYS * DAY:
+        return store.query(station, start, end)
+
+    period = 'hourly' if last - first <= DAILY_FROM_DAYS * DAY else 'daily'
+
+    # Behind the store when the readings were stored before the rollups, or not by record_tide.py
+    buckets = rollups.records(station, period)
+    if len(buckets) == 0 or buckets['time'][-1] < PERIODS[period](readings['time'][-1:])[0]:
+        print(f'The {period} rollups of {station} are behind the readings, run tides_rollup.py --rebuild')
+        return store.query(station, start, end)
+
+    buckets = rollups.query(station, period, start, end)
+    if len(buckets) == 0:
+        return TideSeries([], [], station)
+
+    index = len(readings) if end is None else bisect.bisect_left(readings['time'], end)
+
+    return RollupSeries(buckets, np.array(readings[max(index - 2, 0):index]), station)
+
+
+def print_rollups(station, buckets, period='daily'):
+
+    from tides import london_time_from_epoch
+
+    date_format = '%Y-%m-%d' if period == 'daily' else '%Y-%m-%d %H:%M'
+    print(f'\n=== {station}, {period}\n')
+
+    for bucket in buckets:
+        print(f'{london_time_from_epoch(bucket["time"]):{date_format}}'
+              f'  min {bucket["min"]:5.2f}m at {london_time_from_epoch(bucket["min_time"]):%H:%M}'
+              f'  max {bucket["max"]:5.2f}m at {london_time_from_epoch(bucket["max_time"]):%H:%M}'
+              f'  avg {bucket["sum"] / bucket["count"]:5.2f}m'
+              f'  rise {bucket["max_rise"]:5.1f}  fall {bucket["max_fall"]:5.1f}cm/min')
+
+
+def main():
+
+    from tides import STATIONS, epoch_from_date
+    from tides_events import print_events
+
+    parser = argparse.ArgumentParser(description='Hourly and daily rollups and tide table of the recorded readings')
+    parser.add_argument('--station', help='station', default='Chelsea')
+    parser.add_argument('--all', help='all stations', action='store_true')
+    parser.add_argument('--rebuild', help='recompute them from all the readings recorded by record_tide.py',
+                        action='store_true')
+    parser.add_argument('--hourly', help='hourly rather than daily', action='store_true')
+    parser.add_argument('--tides', help='the high and low waters', action='store_true')
+    parser.add_argument('--from', dest='start', help='from this date (YYYY-MM-DD[THH:MM], UTC)')
+    parser.add_argument('--to', dest='end', help='until this date, default the latest')
+    args = parser.parse_args()
+
+    stations = list(STATIONS) if args.all else [args.station]
+    if any(station not in STATIONS for station in stations):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    try:
+        start, end = epoch_from_date(args.start), epoch_from_date(args.end)
+    except ValueError as e:
+        parser.error(str(e))
+
+    rollups = RollupStore()
+    period = 'hourly' if args.hourly else 'daily'
+
+    for station in stations:
+        if args.rebuild:
+            print(f'{rollups.rebuild(station)} buckets of {station} recomputed')
+            continue
+
+        if args.tides:
+            print_events(rollups.tide_table(station, start, end))
+        else:
+            print_rollups(station, rollups.query(station, period, start, end), period)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,106 @@
+"""
+Append only store of the recorded water levels, one file per station.
+
+The files are arrays of fixed width records (int64 UTC epoch seconds, float32 level),
+sorted by time, so they can be memory mapped and binary searched.
+"""
+
+import os
+import bisect
+import numpy as np
+from tides_series import TideSeries
+
+
+STORE_DIR = 'store'  # Relative to the current directory
+
+RECORD = np.dtype([('time', '<i8'), ('level', '<f4')])
+
+
+def read_records(path, dtype):
+    """ Read only memory map of the records of the file, empty when there's none """
+
+    count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+
+    # A partly written last record (crash while appending) is left out
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def write_records(path, records, keep=None):
+    """ Append the records to the file, after its first keep records when given - the others replaced """
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        if keep is None:
+            keep = os.fstat(f.fileno()).st_size // records.dtype.itemsize
+
+        # Overwritten in place, then cut after them: the file never gets shorter under a reader
+        # mapping it, and a partly written record (crash while appending) is dropped
+        f.seek(keep * records.dtype.itemsize)
+        f.write(records.tobytes())
+        f.truncate()
+
+
+class TideStore:
+
+    def __init__(self, directory=STORE_DIR):
+
+        self.directory = directory
+
+    def path(self, station):
+
+        return os.path.join(self.directory, f'{station.replace(" ", "_")}.tides')
+
+    def records(self, station):
+        """ Read only memory map of all the records of the station """
+
+        return read_records(self.path(station), RECORD)
+
+    def last_time(self, station):
+        """ Time of the latest record, None when nothing is stored """
+
+        records = self.records(station)
+
+        return int(records['time'][-1]) if len(records) else None
+
+    def append(self, series):
+        """ Store the readings of the series newer than the latest stored - returns how many """
+
+        last_time = self.last_time(series.station)
+
+        times, levels = series.times, series.levels
+        if last_time is not None:
+            newer = times > last_time
+            times, levels = times[newer], levels[newer]
+
+        # Sorted, without the readings the station pages repeat
+        times, index = np.unique(times, return_index=True)
+        if len(times) == 0:
+            return 0
+
+        records = np.empty(len(times), dtype=RECORD)
+        records['time'] = times
+        records['level'] = levels[index]
+
+        write_records(self.path(series.station), records)
+
+        return len(records)
+
+    def query(self, station, start=None, end=None):
+        """ Series of the readings in [start, end) - UTC epoch seconds, None for unbounded """
+
+        records = self.records(station)
+        times = records['time']
+
+        # Binary searches reading only the records they look at - np.searchsorted would first
+        # copy the whole strided time column out of the records
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(records) if end is None else bisect.bisect_left(times, end, lo=first)
+
+        # Copy just the slice out of the memory map
+        selected = np.array(records[first:last])
+
+        return TideSeries(selected['time'], selected['level'], station)
@@ -0,0 +1,179 @@
+"""
+Readings of a station over a sliding time window, with statistics kept up to date as readings arrive
+"""
+
+import collections
+import numpy as np
+from tides_series import TideSeries, READING_MINUTES
+
+
+SPEED_FACTOR = np.float32(100 / READING_MINUTES)  # Level difference (m) between readings to cm/min
+
+
+def push_extreme(extremes, time, value, sign):
+    """
+    Add to a monotonic deque of (time, value) - decreasing values for sign 1, increasing for -1 -
+    so its first value is the extreme of the values added after the ones dropped from the front
+    """
+
+    while extremes and sign * extremes[-1][1] <= sign * value:
+        extremes.pop()
+
+    extremes.append((time, value))
+
+
+def drop_older(extremes, cutoff):
+
+    while extremes and extremes[0][0] < cutoff:
+        extremes.popleft()
+
+
+class TideWindow:
+    """
+    The readings of a station over the last span seconds, extended with only the readings
+    newer than the latest one. Running sum for the mean and monotonic deques for the extreme
+    levels and rise speeds: adding a reading costs O(1) amortised, no rescan of the window.
+
+    Has the times, levels, speed and statistics of a TideSeries, so it can be reported the same way.
+    """
+
+    def __init__(self, station='', span=None):
+
+        self.station = station
+        self.span = span
+
+        self.readings: collections.deque = collections.deque()  # (time, level)
+        self.total = 0.0
+
+        self.max_levels: collections.deque = collections.deque()
+        self.min_levels: collections.deque = collections.deque()
+        # Speed between two readings, by the time of the first one
+        self.max_speeds: collections.deque = collections.deque()
+        self.min_speeds: collections.deque = collections.deque()
+
+        self.series = None
+
+    @classmethod
+    def from_series(cls, series):
+        """ Window over the time span of the series """
+
+        span = int(series.times[-1] - series.times[0]) if len(series) else None
+        window = cls(series.station, span)
+        window.extend(series)
+
+        return window
+
+    def __len__(self):
+
+        return len(self.readings)
+
+    def __repr__(self):
+
+        return f'TideWindow({self.station!r}, {len(self)} readings)'
+
+    @property
+    def last_time(self):
+
+        return self.readings[-1][0] if self.readings else None
+
+    def extend(self, series):
+        """ Add the readings of the series newer than the latest in the window - returns how many """
+
+        added = 0
+
+        # Skip to the new readings - the series is in time order
+        start = np.searchsorted(series.times, self.readings[-1][0], side='right') if self.readings else 0
+
+        for time, level in zip(series.times[start:].tolist(), series.levels[start:]):
+            if self.readings and time <= self.readings[-1][0]:
+                # Repeated by the station page
+                continue
+
+            if self.readings:
+                previous_time, previous_level = self.readings[-1]
+                speed = float((level - np.float32(previous_level)) * SPEED_FACTOR)
+                push_extreme(self.max_speeds, previous_time, speed, 1)
+                push_extreme(self.min_speeds, previous_time, speed, -1)
+
+            level = float(level)
+            self.readings.append((time, level))
+            self.total += level
+            push_extreme(self.max_levels, time, level, 1)
+            push_extreme(self.min_levels, time, level, -1)
+            added += 1
+
+        if added:
+            self.slide()
+            self.series = None
+
+        return added
+
+    def slide(self):
+        """ Drop what is older than the span before the latest reading """
+
+        if self.span is None:
+            return
+
+        cutoff = self.readings[-1][0] - self.span
+
+        while self.readings[0][0] < cutoff:
+            _, level = self.readings.popleft()
+            self.total -= level
+
+        for extremes in (self.max_levels, self.min_levels, self.max_speeds, self.min_speeds):
+            drop_older(extremes, cutoff)
+
+    def to_series(self):
+        """ TideSeries of the readings in the window, made again only after new readings """
+
+        if self.series is None:
+            times, levels = zip(*self.readings) if self.readings else ((), ())
+            self.series = TideSeries(times, levels, self.station)
+
+        return self.series
+
+    @property
+    def times(self):
+
+        return self.to_series().times
+
+    @property
+    def levels(self):
+
+        return self.to_series().levels
+
+    @property
+    def speed(self):
+
+        return self.to_series().speed
+
+    @property
+    def max_level(self):
+
+        return self.max_levels[0][1]
+
+    @property
+    def min_level(self):
+
+        return self.min_levels[0][1]
+
+    @property
+    def mean_level(self):
+
+        return self.total / len(self.readings)
+
+    @property
+    def amplitude(self):
+
+        return self.max_level - self.min_level
+
+    @property
+    def max_rise_speed(self):
+
+        return self.max_speeds[0][1]
+
+    @property
+    def max_fall_speed(self):
+        """ The most negative rise speed """
+
+        return self.min_speeds[0][1]
@@ -1,4 +1,5 @@
-from tides import process_from_web
+from tides import STATIONS, TIDE_INFO_WEBPAGE_TEMPLATE, tide_series_from_web, process
+from page_cache import PageCache
 
 
 page = '''<!doctype html>
@@ -16,14 +17,36 @@ page = '''<!doctype html>
 </html>'''
 
 
+SITE = 'Chelsea'
+
+# Module state survives between invocations of a warm container
+page_cache = PageCache()
+
+
+def load_series(station):
+
+    return tide_series_from_web(TIDE_INFO_WEBPAGE_TEMPLATE.format(station=STATIONS[station][0]), station)
+
+
+def render(station, series):
+
+    base64_content = process(series, station, show_plot=False, save_to_file=True,
+                             all_five_days=False, save_plot_png=False, return_base64=True)
+
+    return page.format(image=base64_content.decode("utf-8")) if base64_content is not None else None
+
+
 def handler(event, context):
 
-    base64_content = process_from_web('Chelsea', show_plot=False, save_to_file=True,
-                                      all_five_days=False, save_plot_png=False, return_base64=True)
+    html, status = page_cache.get(SITE, load_series, render)
+    print(f'Page cache {status} for {SITE}')
+
+    if html is None:
+        return f'No tide data for {SITE} at the moment, try again later.'
 
-    return page.format(image=base64_content.decode("utf-8"))
+    return f'{html}\n<!-- page cache {status} -->'
 
 
 if __name__ == '__main__':
 
-    handler()
+    handler(None, None)
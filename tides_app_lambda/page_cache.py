@@ -0,0 +1,130 @@
+"""
+Rendered pages kept between invocations of a warm Lambda container - in memory, then in /tmp
+"""
+
+import os
+import json
+import time
+
+
+CACHE_DIR = '/tmp/tides_cache'  # The only writable directory on Lambda, kept while the container is warm
+PUBLICATION_MINUTES = 15  # The stations publish a reading every 15 minutes
+PUBLICATION_DELAY = 60  # Seconds after the quarter hour when the new reading is expected online
+RETRY_SECONDS = 120  # A page the web site had nothing newer for is served that long before asking again
+
+
+def publication_slot(now):
+    """ Number of the 15 minute slot of the latest reading expected online at now (epoch seconds) """
+
+    return int((now - PUBLICATION_DELAY) // (PUBLICATION_MINUTES * 60))
+
+
+class RenderedPage:
+    """
+    Page rendered from the readings of a station up to the observation (UTC epoch seconds),
+    served without asking the web site again within its slot or until retry_after
+    """
+
+    def __init__(self, station, observation, slot, html, retry_after=0):
+
+        self.station = station
+        self.observation = observation
+        self.slot = slot
+        self.html = html
+        self.retry_after = retry_after
+
+
+class PageCache:
+    """
+    Pages by station, with the latest observation they show. Within the publication slot
+    of the page it is served without going to the web site. In a later slot the readings
+    are downloaded again, but only rendered if there's a newer observation. When there's
+    none, the web site being late or down, they are downloaded again RETRY_SECONDS later.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+
+        self.directory = directory
+        self.pages = {}
+
+    def path(self, station):
+
+        return os.path.join(self.directory, f'{station.replace(" ", "_")}.json')
+
+    def load(self, station):
+        """ (page, where it was found) - page is None when neither in memory nor in /tmp """
+
+        page = self.pages.get(station)
+        if page is not None:
+            return page, 'memory'
+
+        try:
+            with open(self.path(station)) as f:
+                page = RenderedPage(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None, None
+
+        self.pages[station] = page
+
+        return page, '/tmp'
+
+    def store(self, page):
+
+        self.pages[page.station] = page
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Written aside then renamed, an invocation never reads half a page
+            path = self.path(page.station)
+            with open(f'{path}.part', 'w') as f:
+                json.dump(vars(page), f)
+            os.replace(f'{path}.part', path)
+        except OSError as e:
+            print(f'Couldn\'t save the page of {page.station} in {self.directory}: {e}')
+
+    def retry_later(self, page, now):
+        """ Serve the page as it is to the next invocations, until RETRY_SECONDS from now """
+
+        page.retry_after = now + RETRY_SECONDS
+        self.store(page)
+
+    def get(self, station, load_series, render, now=None):
+        """
+        (html, status) of the page of the station. load_series(station) downloads the
+        readings, render(station, series) makes the page. Status is 'hit memory' or
+        'hit /tmp', 'revalidated' when downloaded again but unchanged, 'miss' when
+        rendered, or 'error'.
+        """
+
+        now = time.time() if now is None else now
+        slot = publication_slot(now)
+
+        page, where = self.load(station)
+        if page is not None and (page.slot >= slot or now < page.retry_after):
+            return page.html, f'hit {where}'
+
+        series = load_series(station)
+        if len(series) == 0:
+            if page is None:
+                return None, 'error'
+
+            # Better an old page than none
+            self.retry_later(page, now)
+            return page.html, 'error'
+
+        observation = int(series.times[-1])
+
+        if page is not None and page.observation == observation:
+            # The web site is late with the new reading
+            self.retry_later(page, now)
+            return page.html, 'revalidated'
+
+        html = render(station, series)
+        if html is None:
+            return (page.html, 'error') if page is not None else (None, 'error')
+
+        page = RenderedPage(station, observation, slot, html)
+        self.store(page)
+
+        return page.html, 'miss'
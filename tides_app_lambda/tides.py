@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
 
 
-import io
+import re
 import base64
-import pytz
 import sys
 import time
 import datetime
-import requests
 import argparse
-from bs4 import BeautifulSoup
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import functools
+import numpy as np
+from tides_series import TideSeries
+from tides_fetch import fetch_parsed, fetch_pages
+from tides_prediction import load_model, FORECAST_HOURS
+from tides_metrics import METRICS
+
+# matplotlib, BeautifulSoup and the modules of --continuous and --events are imported
+# where first needed: listing the stations or serving data doesn't pay for them
 
 #
 # Adrian Rosoga, 19 Jan 2020
@@ -37,207 +41,370 @@ TIDE_INFO_WEBPAGE_TEMPLATE = 'https://flood-warning-information.service.gov.uk/s
 RECORDS_DIR = 'records'  # Directory where figures are saved - relative to the script location directory
 MINUTES_TO_SLEEP = 10
 
+# One row of the observed data table - see parse() for the markup
+ROW_PATTERN = re.compile(r'<time datetime="[^"]*">([^<]+?)Z?</time>\s*</td>\s*<td class="numeric">([^<]*)</td>')
+
+
+GMT = datetime.timezone(datetime.timedelta(0), 'GMT')
+BST = datetime.timezone(datetime.timedelta(hours=1), 'BST')
+
+
+def london_dst_transitions(first_year=1996, last_year=2100):
+    """ UTC epoch seconds when BST starts and ends - 01:00 UTC on the last Sunday of March and October """
+
+    transitions = []
+
+    for year in range(first_year, last_year + 1):
+        for month in (3, 10):
+            last_day = datetime.datetime(year, month, 31, 1, tzinfo=datetime.timezone.utc)
+            last_sunday = last_day - datetime.timedelta(days=(last_day.weekday() + 1) % 7)
+            transitions.append(int(last_sunday.timestamp()))
+
+    return np.array(transitions, dtype=np.int64)
+
+
+# Alternating BST start, BST end - so an odd number of transitions passed means BST
+LONDON_DST_TRANSITIONS = london_dst_transitions()
+
+
+def london_offsets(epochs):
+    """ Offset in seconds of London time from UTC for each of the UTC epoch seconds """
+
+    passed = np.searchsorted(LONDON_DST_TRANSITIONS, epochs, side='right')
+
+    return (passed % 2) * 3600
+
+
+def london_datetime64(epochs):
+    """ London wall clock times (naive datetime64) of the UTC epoch seconds - for plotting """
+
+    epochs = np.asarray(epochs, dtype=np.int64)
+
+    return (epochs + london_offsets(epochs)).astype('datetime64[s]')
+
+
+def london_time_from_epoch(epoch):
+    """ Timezone aware London time of the UTC epoch seconds - for display """
+
+    tz = BST if london_offsets(epoch) else GMT
+
+    return datetime.datetime.fromtimestamp(int(epoch), tz)
+
+
+def epoch_from_date(text):
+    """ UTC epoch seconds of '2020-01-14' or '2020-01-14T17:15' like dates, UTC unless they say - None for None """
+
+    if text is None:
+        return None
+
+    date = datetime.datetime.fromisoformat(text)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return int(date.timestamp())
+
+
+def decode_timestamps(timestrings):
+    """ UTC epoch seconds of '2020-01-14T17:15Z' like strings, decoded in one go """
+
+    return np.array([t.rstrip('Z') for t in timestrings], dtype='datetime64[m]').astype(np.int64) * 60
+
 
 def london_time(timestring):
 
-    tz = pytz.timezone('UTC')
-    naive_time = datetime.datetime.strptime(timestring, "%Y-%m-%dT%H:%MZ")
-    tz_time = tz.localize(naive_time)
-    london_tz = pytz.timezone('Europe/London')
-    london_time = tz_time.astimezone(london_tz)
+    return london_time_from_epoch(decode_timestamps([timestring])[0])
 
-    return london_time
 
+def rows_from_series(series):
+    """ (London time, level) tuples of the series """
 
-def tide_data_generator_from_web(tide_info_page: str):
+    # Levels are kept as float32, the readings are to the mm
+    levels = np.round(series.levels.astype(float), 3)
 
-    page = requests.get(tide_info_page)
+    for epoch, level in zip(series.times.tolist(), levels.tolist()):
+        yield london_time_from_epoch(epoch), level
 
-    if page.status_code != requests.codes.ok:
-        print(f'Couldn\'t open the web page {tide_info_page}')
-        raise StopIteration
 
-    return parse(page.text)
+def tide_series_from_page(station, page):
 
+    times, levels = parse_columns(page)
+
+    return TideSeries(times, levels, station)
+
+
+def tide_series_from_web(tide_info_page: str, station=''):
+
+    # Parsed only if the page changed since the last call
+    series = fetch_parsed(tide_info_page, functools.partial(tide_series_from_page, station))
+
+    return series if series is not None else TideSeries([], [], station)
+
+
+def tide_series_from_web_concurrently(stations):
+    """ (station, series) of the stations, each parsed as soon as its page arrives """
+
+    tide_info_pages = {station: TIDE_INFO_WEBPAGE_TEMPLATE.format(station=STATIONS[station][0])
+                       for station in stations}
+
+    for station, series in fetch_pages(tide_info_pages, parse=tide_series_from_page):
+        yield station, series if series is not None else TideSeries([], [], station)
 
-def tide_data_generator_from_file(filename: str):
+
+def tide_series_from_file(filename: str, station=''):
 
     with open(filename) as f:
-        return parse(f.read())
+        times, levels = parse_columns(f.read())
+
+    return TideSeries(times, levels, station)
+
+
+def tide_data_generator_from_web(tide_info_page: str):
+
+    return rows_from_series(tide_series_from_web(tide_info_page))
+
+
+def tide_data_generator_from_file(filename: str):
+
+    return rows_from_series(tide_series_from_file(filename))
 
 
 def parse(file_content):
 
+    return rows_from_series(TideSeries(*parse_columns(file_content)))
+
+
+def parse_columns(file_content):
+
     """
     <tr>
          <td scope="row"><time datetime="2020-01-14T17:15Z">2020-01-14T17:15Z</time></td>
          <td class="numeric">3.622</td>
          <td>false</td>
     </tr>
+
+    Returns the UTC epoch seconds and the levels as arrays, oldest first.
     """
 
+    METRICS.add_bytes('parse', len(file_content))
+
+    with METRICS.timed('parse'):
+        rows = ROW_PATTERN.findall(file_content)
+
+        # Every timestamp on the page should be in a row matched by the pattern,
+        # else the layout has changed and the full (slow) parse is needed
+        timestamps = file_content.count('<time ')
+        if rows and len(rows) == timestamps:
+            timestrings, water_levels = zip(*rows)
+        else:
+            METRICS.error('parse')
+            print(f'Couldn\'t parse the page with the row pattern ({len(rows)} rows, {timestamps} timestamps),'
+                  ' the layout may have changed: parsing it with BeautifulSoup')
+            timestrings, water_levels = parse_soup(file_content)
+
+        if not timestrings:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # Reverse the order as latest data comes first
+        return decode_timestamps(timestrings)[::-1], np.array(water_levels, dtype=float)[::-1]
+
+
+def parse_soup(file_content):
+
+    """ Fallback parser building the whole page with BeautifulSoup, returns the timestamps and levels as text """
+
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(file_content, features="lxml")
-    rows = soup.find_all('tr')
 
-    # Reverse the order as latest data comes first
-    for row in reversed(rows):
+    timestrings = []
+    water_levels = []
+
+    for row in soup.find_all('tr'):
         timestamp = row.find('time')
         if timestamp:
-            timestamp_obj = london_time(timestamp.text)
-            water_level = row.find('td', {"class": "numeric"})
-            yield timestamp_obj, float(water_level.text)
-
+            timestrings.append(timestamp.text)
+            water_levels.append(row.find('td', {"class": "numeric"}).text)
 
-def process(generator, station='', show_plot=True, save_to_file=False, all_five_days=False,
-            save_plot_png=False, return_base64=False):
+    return timestrings, water_levels
 
-    dates = []
-    levels = []
 
-    for timestamp, level in generator:
-        dates.append(timestamp)
-        levels.append(level)
+def process(series, station='', show_plot=True, save_to_file=False, all_five_days=False,
+            save_plot_png=False, return_base64=False, return_png=False):
 
     if not all_five_days:
         # Analize only the last 2 days
-        dates = dates[4 * 24 * 4:]
-        levels = levels[4 * 24 * 4:]
+        series = series[4 * 24 * 4:]
 
-    if len(dates) == 0:
+    if len(series) == 0:
         print('No data!')
         return
 
-    tide_speed_cm_per_min = [(l2 - l1) * 100.0 / 15.0 for l2, l1 in zip(levels[1:], levels[:-1])]
+    return report(series, station, show_plot, save_to_file, all_five_days, save_plot_png, return_base64, return_png)
 
-    if False:
-        for date, level, speed in zip(dates, levels, tide_speed_cm_per_min):
-            print(f'{date}: Level={level:5.2f}m   Rise={speed:5.2f}cm/min')
 
-    print('\n'.join((f'\n=== {station} from {dates[0]} to {dates[-1]}\n',
-                     f'Current datetime {dates[-1]}',
-                     f'Current level {levels[-1]:.1f}m',
-                     f'Current tide speed {tide_speed_cm_per_min[-1]:.1f}cm/min',
-                     f'Max level {max(levels):.1f}m',
-                     f'Min level {min(levels):.1f}m',
-                     f'Avg level {sum(levels)/len(levels):.1f}m',
-                     f'Amplitude {max(levels) - min(levels):.1f}m',
-                     f'Max tide rise speed {max(tide_speed_cm_per_min):.1f}cm/min',
-                     f'Max tide decrease speed {min(tide_speed_cm_per_min):.1f}cm/min')))
+def report(series, station='', show_plot=True, save_to_file=False, all_five_days=False,
+           save_plot_png=False, return_base64=False, return_png=False):
+    """ Print the statistics of the series, a TideSeries, TideWindow or RollupSeries, and plot it """
 
-    return plot(station, dates, levels, tide_speed_cm_per_min, show_plot, save_to_file,
-                all_five_days, save_plot_png, return_base64)
+    with METRICS.timed('compute'):
+        # London time is only needed for what gets displayed
+        first_date = london_time_from_epoch(series.times[0])
+        last_date = london_time_from_epoch(series.times[-1])
 
+        if False:
+            for date, level, speed in zip(london_datetime64(series.times), series.levels, series.speed):
+                print(f'{date}: Level={level:5.2f}m   Rise={speed:5.2f}cm/min')
 
-def plot(station, dates, levels, tide_speed_cm_per_min, show_plot, save_to_file,
-         all_five_days=False, save_plot_png=False, return_base64=False):
+        lines = (f'\n=== {station} from {first_date} to {last_date}\n',
+                 f'Current datetime {last_date}',
+                 f'Current level {series.levels[-1]:.1f}m',
+                 f'Current tide speed {series.speed[-1]:.1f}cm/min',
+                 f'Max level {series.max_level:.1f}m',
+                 f'Min level {series.min_level:.1f}m',
+                 f'Avg level {series.mean_level:.1f}m',
+                 f'Amplitude {series.amplitude:.1f}m',
+                 f'Max tide rise speed {series.max_rise_speed:.1f}cm/min',
+                 f'Max tide decrease speed {series.max_fall_speed:.1f}cm/min')
 
-    # Colors from http://ksrowell.com/blog-visualizing-data/2012/02/02/optimal-colors-for-graphs/
-    water_color = '#396AB1'
-    tide_rise_color = '#DA7C30'
-    title_color = '#535154'
-    box_background_color = '#CCC210'
+    print('\n'.join(lines))
 
-    station_description = STATIONS[station][1]
+    return plot(station, series, show_plot, save_to_file, all_five_days, save_plot_png, return_base64, return_png)
 
-    figure = plt.figure(figsize=(20, 10))
-    plot = figure.add_subplot(111)
 
-    plot.plot(dates, levels, water_color, marker='.', linewidth=3.0, label='Water level')
+def plot(station, series, show_plot, save_to_file, all_five_days=False, save_plot_png=False, return_base64=False,
+         return_png=False):
 
-    plt.ylabel('Water level (m)', color=water_color, fontweight='bold', fontsize=22)
+    if not (show_plot or save_to_file or return_base64 or return_png):
+        return
 
-    plot2 = plot.twinx()
+    from tides_render import TideRenderer, get_renderer, FIGSIZE
 
-    plot2.plot(dates[:-1], tide_speed_cm_per_min, tide_rise_color, marker='.', linewidth=0.5, label='Tide rise speed')
+    station_description = STATIONS[station][1]
 
-    # Grid
-    plot.axhline(linewidth=1, color='r')
-    plot.grid(color='g', linestyle=':', linewidth=0.5)
+    with METRICS.timed('compute'):
+        dates = london_datetime64(series.times)
+        levels = series.levels
+        first_date = london_time_from_epoch(series.times[0])
+        last_date = london_time_from_epoch(series.times[-1])
 
-    plt.xlabel('Date')
+        title = f'{station_description}\nFrom {first_date} to {last_date}'
+        info = (f'Now={levels[-1]:.1f}m\n(Min={series.min_level:.1f}m Max={series.max_level:.1f}m'
+                f' Avg={series.mean_level:.1f}m Delta={series.amplitude:.1f}m')
 
-    plot.format_xdata = mdates.DateFormatter('%Y-%m-%d %H:%M')
-    plot2.format_xdata = mdates.DateFormatter('%Y-%m-%d %H:%M')
+        # Continued with the predicted levels when the station has a fitted model
+        forecast_dates, forecast_levels = (), ()
+        model = load_model(station)
+        if model is not None:
+            forecast = model.forecast(series.times[-1], series.times[-1] + FORECAST_HOURS * 3600 + 1)
+            forecast_dates, forecast_levels = london_datetime64(forecast.times), forecast.levels
 
-    plt.ylabel('Tide rise speed (cm/min)', color=tide_rise_color, fontweight='bold', fontsize=22)
+    # Return the PNG, base64 encoded or not - the station figure is reused, only its data changes
+    if return_base64 or return_png:
+        with METRICS.timed('render'):
+            png = get_renderer(station).render_png(dates, levels, series.speed, title, info,
+                                                   forecast_dates, forecast_levels)
+        METRICS.add_bytes('render', len(png))
 
-    # Mark the last point on each graph
-    plot.scatter(dates[-1], levels[-1], marker='o', s=400, c=water_color)
-    plot2.scatter(dates[-2], tide_speed_cm_per_min[-1], marker='o', s=400, c=tide_rise_color)
+        if return_png:
+            return png
 
-    title_font = {'family': 'serif',
-                  'color': title_color,
-                  'weight': 'bold',
-                  'size': 24, }
+        with METRICS.timed('encode'):
+            encoded = base64.b64encode(png)
+        METRICS.add_bytes('encode', len(encoded))
 
-    # Title
-    plt.title(f'{station_description}\nFrom {dates[0]} to {dates[-1]}', fontdict=title_font)
+        return encoded
 
-    # Rotate the x axis to avoid overlapping
-    for label in plot.get_xticklabels() + plot2.get_xticklabels():
-        label.set_rotation(30)
-        label.set_ha('right')
-        label.set_fontsize(12)
+    # A pyplot figure when it is shown on screen
+    if show_plot:
+        import matplotlib.pyplot as plt
+
+        figure = plt.figure(figsize=FIGSIZE)
+        renderer = TideRenderer(figure)
+    else:
+        renderer = get_renderer(station)
+
+    with renderer.lock:
+        with METRICS.timed('render'):
+            renderer.draw(dates, levels, series.speed, title, info, forecast_dates, forecast_levels)
+
+        # Save to file
+        if save_to_file:
+            number_days = 5 if all_five_days else 2
+            # Longer when it's from the recorded history
+            span_days = (series.times[-1] - series.times[0]) / (24 * 3600)
+            if span_days > 5:
+                number_days = round(span_days)
+
+            if save_plot_png:
+                pathname = "plot.png"
+            else:
+                filename_date = str(last_date).replace(':', '-')
+                filename = f'{station_description}_{filename_date}_{number_days}_days.png'.replace(' ', '_')
+                pathname = f'{RECORDS_DIR}/{filename}'
+
+            try:
+                with METRICS.timed('render'):
+                    renderer.save(pathname, dpi=300)
+                print(f'\nSaved graph as {pathname}')
+            except FileNotFoundError:
+                print(f'\nError: Couldn\'t save graph as {pathname}')
 
-    # Format of date on x axis
-    ax = plt.gca()
-    xaxisFmt = mdates.DateFormatter('%Y-%m-%d %H:%M')
-    ax.xaxis.set_major_formatter(xaxisFmt)
+    if show_plot:
+        plt.show()
+        plt.close(figure)
 
-    # Info about levels
-    level_info_box = plt.text(dates[0], 0,
-                              f'Now={levels[-1]:.1f}m\n(Min={min(levels):.1f}m Max={max(levels):.1f}m'
-                              f' Avg={(sum(levels)/len(levels)):.1f}m Delta={(max(levels) - min(levels)):.1f}m',
-                              fontsize=32)
-    level_info_box.set_bbox(dict(facecolor=box_background_color, alpha=1, edgecolor=box_background_color))
 
-    # Legend
-    plot.legend(loc='upper left', fontsize='x-large')
-    plot2.legend(loc='upper right', fontsize='x-large')
+def watch(stations, minutes_to_sleep=MINUTES_TO_SLEEP, save_to_file=False, all_five_days=False, save_plot_png=False,
+          show_events=False):
+    """
+    Poll the stations forever, keeping a sliding window of the readings of each. Only the
+    new readings are merged in and only the stations with new readings are reported. With
+    show_events, high and low waters are printed as they are seen.
+    """
 
-    # Return base64 encoded
-    if return_base64:
-        image_bytes = io.BytesIO()
-        plt.savefig(image_bytes, format='png')
-        image_bytes.seek(0)
-        plot_png_base64 = base64.b64encode(image_bytes.read())
-        return plot_png_base64
+    from tides_window import TideWindow
+    from tides_events import EventDetector, print_events
 
-    # Save to file
-    if save_to_file:
-        number_days = 5 if all_five_days else 2
+    windows: dict = {}
+    detectors = {station: EventDetector(station) for station in stations}
 
-        if save_plot_png:
-            pathname = "plot.png"
-        else:
-            last_date = str(dates[-1]).replace(':', '-')
-            filename = f'{station_description}_{last_date}_{number_days}_days.png'.replace(' ', '_')
-            pathname = f'{RECORDS_DIR}/{filename}'
+    while True:
+        for station, series in tide_series_from_web_concurrently(stations):
+            if show_events:
+                print_events(detectors[station].extend(series))
 
-        try:
-            plt.savefig(f'{pathname}', dpi=300)
-            print(f'\nSaved graph as {pathname}')
-        except FileNotFoundError:
-            print(f'\nError: Couldn\'t save graph as {pathname}')
+            window = windows.get(station)
 
-    if show_plot:
-        plt.show()
+            if window is None:
+                if not all_five_days:
+                    series = series[4 * 24 * 4:]
+                if len(series) == 0:
+                    continue
+                window = windows[station] = TideWindow.from_series(series)
+            elif window.extend(series) == 0:
+                continue
+
+            report(window, station, show_plot=False, save_to_file=save_to_file, all_five_days=all_five_days,
+                   save_plot_png=save_plot_png)
+
+        print(f'Sleeping {minutes_to_sleep} minutes...')
+        time.sleep(minutes_to_sleep * 60)
 
 
 def process_from_web(station: str, show_plot=True, save_to_file=False, all_five_days=False,
-                     save_plot_png=False, return_base64=False):
+                     save_plot_png=False, return_base64=False, return_png=False):
 
     tide_info_page = TIDE_INFO_WEBPAGE_TEMPLATE.format(station=STATIONS[station][0])
 
-    return process(tide_data_generator_from_web(tide_info_page), station, show_plot, save_to_file,
-                   all_five_days, save_plot_png, return_base64)
+    return process(tide_series_from_web(tide_info_page, station), station, show_plot, save_to_file,
+                   all_five_days, save_plot_png, return_base64, return_png)
 
 
 def process_from_file(station: str, filename: str, show_plot=True, save_to_file=False, all_five_days=False,
-                      save_plot_png=False, return_base64=False):
+                      save_plot_png=False, return_base64=False, return_png=False):
 
-    return process(tide_data_generator_from_file(filename), station, show_plot, save_to_file,
-                   all_five_days, save_plot_png, return_base64)
+    return process(tide_series_from_file(filename, station), station, show_plot, save_to_file,
+                   all_five_days, save_plot_png, return_base64, return_png)
 
 
 if __name__ == '__main__':
@@ -250,8 +417,13 @@ if __name__ == '__main__':
     parser.add_argument('--noplot', help='do not show the plot on screen', action='store_true')
     parser.add_argument('--save', help='save to file', action='store_true')
     parser.add_argument('--five', help='all (five) days', action='store_true')
-    parser.add_argument(f'--continuous', help='repeat every {MINUTES_TO_SLEEP} mins', action='store_true')
+    parser.add_argument(f'--continuous', help='repeat every {MINUTES_TO_SLEEP} mins, with --all for all stations',
+                        action='store_true')
+    parser.add_argument('--interval', help='minutes between polls with --continuous', type=float,
+                        default=MINUTES_TO_SLEEP)
     parser.add_argument('--save_plot_png', help='save as plot.png', action='store_true')
+    parser.add_argument('--events', help='high and low water times, as they come with --continuous',
+                        action='store_true')
     args = parser.parse_args()
 
     if args.list:
@@ -268,10 +440,17 @@ if __name__ == '__main__':
     # Fallback - Chelsea is nearer until Westminster comes back online (down Feb 2020)
     station = args.station if args.station else 'Chelsea'
 
-    if args.all:
-        for station in STATIONS:
-            process_from_web(station, show_plot=show_plot, save_to_file=save_to_file,
-                             all_five_days=all_five_days, save_plot_png=save_plot_png)
+    if args.events and not args.continuous:
+        from tides_events import detect_events, print_events
+
+        for station, series in tide_series_from_web_concurrently(STATIONS if args.all else [station]):
+            print_events(detect_events(series))
+        sys.exit(0)
+
+    if args.all and not args.continuous:
+        for station, series in tide_series_from_web_concurrently(STATIONS):
+            process(series, station, show_plot=show_plot, save_to_file=save_to_file,
+                    all_five_days=all_five_days, save_plot_png=save_plot_png)
         sys.exit(0)
 
     if args.file:
@@ -282,10 +461,8 @@ if __name__ == '__main__':
         sys.exit(0)
 
     if args.continuous:
-        while True:
-            process_from_web(station, show_plot=False, save_to_file=save_to_file, all_five_days=all_five_days)
-            print(f'Sleeping {MINUTES_TO_SLEEP} minutes...')
-            time.sleep(MINUTES_TO_SLEEP * 60)
+        watch(STATIONS if args.all else [station], args.interval, save_to_file=save_to_file,
+              all_five_days=all_five_days, save_plot_png=save_plot_png, show_events=args.events)
 
     process_from_web(station, show_plot=show_plot, save_to_file=save_to_file,
                      all_five_days=all_five_days)
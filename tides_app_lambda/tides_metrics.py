@@ -0,0 +1,147 @@
+"""
+Latency, byte and error counts of the stages from the station page to the image - fetch,
+parse, compute, render and encode - kept in memory and shown in the Prometheus text format.
+
+Timing a stage costs two perf_counter() calls and a lock, around a microsecond against
+the milliseconds of the stages, so it stays on.
+"""
+
+import time
+import bisect
+import threading
+
+
+STAGES = ('fetch', 'parse', 'compute', 'render', 'encode')
+PREFIX = 'tides_stage'
+
+# Upper bounds (s) of the latency histogram buckets - from parsing a page to a slow download
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class StageMetrics:
+    """ Latency histogram, bytes and errors of one stage """
+
+    def __init__(self, buckets=BUCKETS):
+
+        self.buckets = buckets
+        # Calls per bucket, not cumulative - the last one is above all the bounds
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def observe(self, seconds):
+
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Timed:
+    """ Context manager timing a stage - an exception leaving it counts as an error of the stage """
+
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.metrics.observe(self.stage, time.perf_counter() - self.start, error=exc_type is not None)
+
+        return False
+
+
+class Metrics:
+    """
+    Stage metrics of the process. The timings of the current thread can also be traced,
+    e.g. to log where the time of a request went.
+    """
+
+    def __init__(self, stages=STAGES, buckets=BUCKETS):
+
+        self.buckets = buckets
+        self.stages = {stage: StageMetrics(buckets) for stage in stages}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def timed(self, stage):
+
+        return Timed(self, stage)
+
+    def observe(self, stage, seconds, error=False):
+
+        with self.lock:
+            metrics = self.stages[stage]
+            metrics.observe(seconds)
+            if error:
+                metrics.errors += 1
+
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace.append((stage, seconds))
+
+    def add_bytes(self, stage, count):
+
+        with self.lock:
+            self.stages[stage].bytes += count
+
+    def error(self, stage):
+        """ A failure not raised as an exception, e.g. a page that couldn't be downloaded """
+
+        with self.lock:
+            self.stages[stage].errors += 1
+
+    def start_trace(self):
+
+        self.local.trace = []
+
+    def end_trace(self):
+        """ (stage, seconds) timed on this thread since start_trace() """
+
+        trace = getattr(self.local, 'trace', None)
+        self.local.trace = None
+
+        return trace or []
+
+    def exposition(self):
+        """ All the metrics in the Prometheus text format """
+
+        lines = [f'# HELP {PREFIX}_seconds Latency of the stages from the station page to the image',
+                 f'# TYPE {PREFIX}_seconds histogram']
+
+        with self.lock:
+            for stage, metrics in self.stages.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), metrics.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_seconds_sum{{stage="{stage}"}} {metrics.sum!r}')
+                lines.append(f'{PREFIX}_seconds_count{{stage="{stage}"}} {metrics.count}')
+
+            lines += [f'# HELP {PREFIX}_bytes_total Bytes downloaded (fetch), parsed (parse) or produced (render, encode)',
+                      f'# TYPE {PREFIX}_bytes_total counter']
+            lines += [f'{PREFIX}_bytes_total{{stage="{stage}"}} {metrics.bytes}'
+                      for stage, metrics in self.stages.items()]
+
+            lines += [f'# HELP {PREFIX}_errors_total Failed calls of the stages',
+                      f'# TYPE {PREFIX}_errors_total counter']
+            lines += [f'{PREFIX}_errors_total{{stage="{stage}"}} {metrics.errors}'
+                      for stage, metrics in self.stages.items()]
+
+        return '\n'.join(lines) + '\n'
+
+
+# The metrics of the process
+METRICS = Metrics()
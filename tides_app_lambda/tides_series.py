@@ -0,0 +1,87 @@
+"""
+Water level time series of a station, kept as columns
+"""
+
+import functools
+import numpy as np
+
+
+READING_MINUTES = 15  # Interval between readings published for a station
+
+
+class TideSeries:
+    """
+    Levels (m, float32) at times (UTC epoch seconds, int64), oldest first.
+
+    Statistics are computed once, on first use. Slicing returns a series
+    viewing the same arrays, e.g. series[4 * 24 * 4:] for the last day.
+    """
+
+    def __init__(self, times, levels, station=''):
+
+        self.times = np.asarray(times, dtype=np.int64)
+        self.levels = np.asarray(levels, dtype=np.float32)
+        self.station = station
+
+    @classmethod
+    def from_rows(cls, rows, station=''):
+        """ From (datetime, level) tuples """
+
+        rows = list(rows)
+        times = np.array([int(timestamp.timestamp()) for timestamp, _ in rows], dtype=np.int64)
+        levels = np.array([level for _, level in rows], dtype=np.float32)
+
+        return cls(times, levels, station)
+
+    def __len__(self):
+
+        return len(self.times)
+
+    def __getitem__(self, index):
+
+        if not isinstance(index, slice):
+            raise TypeError('TideSeries only supports slicing')
+
+        return TideSeries(self.times[index], self.levels[index], self.station)
+
+    def __repr__(self):
+
+        return f'TideSeries({self.station!r}, {len(self)} readings)'
+
+    @functools.cached_property
+    def speed(self):
+        """ Tide rise speed (cm/min) between consecutive readings - one shorter than the levels """
+
+        # Not the actual time difference - the station pages repeat some readings
+        return np.diff(self.levels) * np.float32(100 / READING_MINUTES)
+
+    @functools.cached_property
+    def max_level(self):
+
+        return float(self.levels.max())
+
+    @functools.cached_property
+    def min_level(self):
+
+        return float(self.levels.min())
+
+    @functools.cached_property
+    def mean_level(self):
+
+        return float(self.levels.mean(dtype=np.float64))
+
+    @property
+    def amplitude(self):
+
+        return self.max_level - self.min_level
+
+    @functools.cached_property
+    def max_rise_speed(self):
+
+        return float(self.speed.max())
+
+    @functools.cached_property
+    def max_fall_speed(self):
+        """ The most negative rise speed """
+
+        return float(self.speed.min())